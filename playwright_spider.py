@@ -3,7 +3,7 @@ from dataclasses import dataclass, field
 from parsel import Selector
 from playwright.async_api import async_playwright
 from typing import List, Iterator
-from urllib.parse import urljoin
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit
 
 import asyncio
 import csv
@@ -32,6 +32,12 @@ class TrekkyPlaywrightSpider:
     """Pure Playwright implementation of the Trekky spider."""
     start_url = "https://trekky-reviews.com/level9"
 
+    # Cities to crawl. Their listing pages are discovered from the pagination of the first page.
+    cities = ["paris"]
+
+    # Maximum number of listing pages (each with its own browser session) crawled at the same time.
+    listing_concurrency = 4
+
     logger = logging.getLogger(__name__)
 
     async def start(self) -> None:
@@ -39,22 +45,33 @@ class TrekkyPlaywrightSpider:
         if not self.start_url.endswith('/'):
             self.start_url += '/'
 
-        tasks = []
-        # Create separate sessions
-        for page_num in range(1, 10):
-            task = asyncio.create_task(self.parse_homepage(page_num))
-            tasks.append(task)
+        # Highest listing page known per city, updated as the listing pages are parsed.
+        self.last_pages = {city: 1 for city in self.cities}
+        next_pages = {city: 1 for city in self.cities}
+        semaphore = asyncio.Semaphore(self.listing_concurrency)
 
-        # Wait for all tasks to complete
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        async def run(city, page_num):
+            async with semaphore:
+                return await self.parse_homepage(city, page_num)
 
-        # Process results
         hotels = []
-        for result in results:
-            if isinstance(result, Exception):
-                self.logger.error(f"Error occurred: {result}")
-            elif result:
-                hotels.extend(result)
+        pending = set()
+        while True:
+            # Start a session for every newly discovered page, the semaphore caps how many run at once.
+            for city in self.cities:
+                while next_pages[city] <= self.last_pages[city]:
+                    pending.add(asyncio.create_task(run(city, next_pages[city])))
+                    next_pages[city] += 1
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    self.logger.error(f"Error occurred: {task.exception()}")
+                elif task.result():
+                    hotels.extend(task.result())
 
         # Output results to a CSV file matching the required format
         with open('results.csv', 'w', newline='') as f:
@@ -66,8 +83,8 @@ class TrekkyPlaywrightSpider:
 
         self.logger.info(f"Scraped {len(hotels)} hotels and saved to results.csv")
 
-    async def parse_homepage(self, page_num) -> List[HotelItem]:
-        """This method starts a session for the homepage and retrieves the list of hotels in Paris from page X."""
+    async def parse_homepage(self, city, page_num) -> List[HotelItem]:
+        """This method starts a session for the homepage and retrieves the list of hotels in city X from page Y."""
         hotels = []
 
         try:
@@ -80,7 +97,7 @@ class TrekkyPlaywrightSpider:
                 )
 
                 # Open a new page and navigate to the homepage
-                self.logger.info(f"Go to homepage for page {page_num}")
+                self.logger.info(f"Go to homepage for {city} page {page_num}")
 
                 page = await context.new_page()
                 await page.route('**/*.{png,jpg,jpeg,svg,gif,css}', lambda route: route.abort())
@@ -88,8 +105,8 @@ class TrekkyPlaywrightSpider:
                 await page.wait_for_timeout(2000)
 
                 # Navigate to the listing page and get the hotels
-                url = urljoin(self.start_url, f"cities?city=paris&page={page_num}")
-                async for hotel in self.parse_listing(page, url):
+                url = urljoin(self.start_url, "cities?" + urlencode({"city": city, "page": page_num}))
+                async for hotel in self.parse_listing(page, url, city, page_num):
                     hotels.append(hotel)
 
                 # Close the page and context
@@ -98,13 +115,13 @@ class TrekkyPlaywrightSpider:
                 await browser.close()
 
         except Exception as e:
-            self.logger.error(f"Error in session {page_num}: {e}")
+            self.logger.error(f"Error in session {city} {page_num}: {e}")
             raise
 
         return hotels
 
-    async def parse_listing(self, page, url) -> Iterator[HotelItem]:
-        """This method parses the list of hotels."""
+    async def parse_listing(self, page, url, city, page_num) -> Iterator[HotelItem]:
+        """This method parses the list of hotels, and discovers the next listing pages."""
         self.logger.info(f"Go to listing page: {url}")
         await page.goto(url, wait_until='networkidle', timeout=60000)
 
@@ -112,8 +129,10 @@ class TrekkyPlaywrightSpider:
         await page.wait_for_timeout(5000)
 
         selector = Selector(text=await page.content())
+        links = selector.css('.hotel-link')
+        self.discover_pages(selector, city, page_num, bool(links))
 
-        for link in selector.css('.hotel-link'):
+        for link in links:
             href = link.attrib.get('href')
             if href:
                 hotel_url = urljoin(self.start_url, href)
@@ -125,6 +144,17 @@ class TrekkyPlaywrightSpider:
                 except Exception as e:
                     self.logger.error(f"Error scraping hotel {hotel_url}: {e}")
 
+    def discover_pages(self, selector, city, page_num, has_hotels) -> None:
+        """Update the last listing page of the city from the pagination links, or probe the next page if there are none."""
+        pages = []
+        for href in selector.css('.pagination a.page-link::attr(href)').getall():
+            query = parse_qs(urlsplit(href).query)
+            if query.get('city', [city])[0] == city and query.get('page', [''])[0].isdigit():
+                pages.append(int(query['page'][0]))
+
+        last = max(pages) if pages else (page_num + 1 if has_hotels else page_num)
+        self.last_pages[city] = max(self.last_pages[city], last)
+
     async def parse_hotel(self, page, url) -> HotelItem | None:
         """This method parses hotel details."""
         try:
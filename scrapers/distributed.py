@@ -0,0 +1,409 @@
+"""
+A distributed mode, which runs a spider in several worker processes sharing a frontier on disk.
+
+The frontier is a SQLite file holding the requests waiting for a worker, the fingerprints of the
+requests seen by all the workers, the state of the workers and the token buckets of the global rate
+limits (see scrapers.middlewares.ratelimit). Each worker runs the spider with the FrontierScheduler
+and the FrontierDupeFilter:
+- a request with the ``frontier`` meta key starts a new session (e.g. a listing page): it goes to
+  the frontier, and is taken by the first worker with room for it, so the work is shared out by
+  session. The requests built from its response stay in that worker, with the cookies of their
+  session, like all the requests without the key;
+- a request with the ``frontier_key`` meta key is only enqueued once by all the workers, even
+  with dont_filter, and the other requests are filtered on their fingerprints by all the workers;
+- a worker with nothing left to do waits for the others, and stops when the frontier is empty and
+  all the workers are idle.
+
+The coordinator creates the frontier, splits the cities of the spider between the workers, runs
+them and merges their CSV outputs at the end:
+
+    python -m scrapers.distributed --workers 4 -a cities=paris,lyon,nice
+
+The INCREMENTAL_PATH, HOTEL_INDEX_PATH and JOBDIR files are kept per worker: the state of the
+previous runs is only used by the worker which recorded it, when it takes the same listing pages.
+
+You can change the behaviour of the workers by modifying the scraping settings:
+DISTRIBUTED_BATCH_SIZE - number of requests taken from the frontier at once
+DISTRIBUTED_POLL_INTERVAL - seconds between two polls of the frontier by an idle worker
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import pickle
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.http.request import Request
+from scrapy.utils.request import request_from_dict
+from twisted.internet import reactor
+
+from scrapers.scheduler import DelayedRequestScheduler
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    priority INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_priority ON requests (priority DESC, id);
+CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS workers (id INTEGER PRIMARY KEY, busy INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+"""
+
+
+class Frontier:
+    """The requests, fingerprints, workers and rate limits shared by the workers, in a SQLite file."""
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    @classmethod
+    def create(cls, path: str, workers: int) -> Frontier:
+        """Create an empty frontier, in which all the workers are busy until they poll it."""
+        for suffix in ("", "-wal", "-shm"):
+            Path(path + suffix).unlink(missing_ok=True)
+
+        frontier = cls(path)
+        frontier.db.executescript(SCHEMA)
+        frontier.db.executemany("INSERT INTO workers (id, busy) VALUES (?, 1)", [(i,) for i in range(workers)])
+        return frontier
+
+    @classmethod
+    def from_settings(cls, settings) -> Frontier:
+        return cls(settings.get("DISTRIBUTED_FRONTIER", "frontier.db"))
+
+    def close(self) -> None:
+        self.db.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def seen(self, key: bytes) -> bool:
+        """Record the key, and return whether it was already recorded."""
+        return self.db.execute("INSERT OR IGNORE INTO seen (key) VALUES (?)", (key,)).rowcount == 0
+
+    def push(self, priority: int, data: bytes) -> None:
+        self.db.execute("INSERT INTO requests (priority, data) VALUES (?, ?)", (priority, data))
+
+    def pop(self, worker: int, count: int) -> List[bytes]:
+        """Take up to *count* requests, by priority, and mark the worker as busy."""
+        # Polled each time a worker has room: don't take the write lock for nothing.
+        if not self.db.execute("SELECT 1 FROM requests LIMIT 1").fetchone():
+            return []
+
+        with self.transaction() as db:
+            rows = db.execute(
+                "DELETE FROM requests WHERE id IN"
+                " (SELECT id FROM requests ORDER BY priority DESC, id LIMIT ?)"
+                " RETURNING priority, id, data",
+                (count,),
+            ).fetchall()
+            if rows:
+                db.execute("UPDATE workers SET busy = 1 WHERE id = ?", (worker,))
+        rows.sort(key=lambda row: (-row[0], row[1]))
+        return [data for _, _, data in rows]
+
+    def pending(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+
+    def set_busy(self, worker: int, busy: bool) -> None:
+        self.db.execute("UPDATE workers SET busy = ? WHERE id = ?", (int(busy), worker))
+
+    def finished(self) -> bool:
+        """Whether no request is left and all the workers are idle: no worker can enqueue a request anymore."""
+        with self.transaction() as db:
+            busy = db.execute("SELECT COUNT(*) FROM workers WHERE busy").fetchone()[0]
+            return not busy and not db.execute("SELECT 1 FROM requests LIMIT 1").fetchone()
+
+    def reserve(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from the bucket of the key, and return the seconds to wait until it is available."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            # The bucket goes negative: the next requests wait for the tokens reserved before them.
+            tokens -= 1
+            db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+        return max(0.0, -tokens / rate)
+
+
+class FrontierDupeFilter(RFPDupeFilter):
+    """Filter the requests on the fingerprints seen by all the workers."""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter = super().from_crawler(crawler)
+        dupefilter.frontier = Frontier.from_settings(crawler.settings)
+        return dupefilter
+
+    def request_seen(self, request: Request) -> bool:
+        return self.frontier.seen(b"fp:" + self.request_fingerprint(request).encode("ascii"))
+
+    def close(self, reason: str) -> None:
+        self.frontier.close()
+        super().close(reason)
+
+
+class FrontierScheduler(DelayedRequestScheduler):
+    """
+    A scheduler which shares the requests with the ``frontier`` meta key with the other workers
+    through the frontier, and takes requests from it once its own queue is empty
+    (see scrapers.distributed).
+
+    Delayed requests and requests to retry at the end stay in the worker which scheduled them,
+    like the requests without the key.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        settings = self.crawler.settings
+        self.worker = settings.getint("DISTRIBUTED_WORKER", 0)
+        self.batch_size = max(1, settings.getint("DISTRIBUTED_BATCH_SIZE", 1))
+        self.poll_interval = settings.getfloat("DISTRIBUTED_POLL_INTERVAL", 0.2)
+        self.frontier: Optional[Frontier] = None
+        self._taken: Deque[Request] = deque()
+        self._idle = False
+        self._poll = None
+
+    def open(self, spider):
+        result = super().open(spider)
+        self.frontier = Frontier.from_settings(self.crawler.settings)
+        return result
+
+    def close(self, reason: str):
+        if self._poll is not None and self._poll.active():
+            self._poll.cancel()
+        if self._taken:
+            self.spider.logger.warning("Dropping %d requests taken from the frontier", len(self._taken))
+        self.frontier.close()
+        return super().close(reason)
+
+    def enqueue_request(self, request: Request) -> bool:
+        if self._idle:
+            # E.g. a session warm-up: the other workers mustn't stop while it runs.
+            self.frontier.set_busy(self.worker, True)
+            self._idle = False
+
+        due = request.meta.get("delay_until")
+        if not request.meta.get("frontier") or request.meta.get("retry_at_end") or (due and due > time.time()):
+            return super().enqueue_request(request)
+
+        # The keys aren't inherited by the requests built from the response, which stay in the worker.
+        del request.meta["frontier"]
+        key = request.meta.pop("frontier_key", None)
+        if key is not None and self.frontier.seen(b"key:" + key.encode("utf-8")):
+            self.stats.inc_value("frontier/duplicates", spider=self.spider)
+            return False
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except (AttributeError, pickle.PicklingError, TypeError, ValueError):
+            # Not serializable, e.g. a callback which isn't a spider method: keep it in this worker.
+            self.stats.inc_value("frontier/unserializable", spider=self.spider)
+            self._mqpush(request)
+            self.stats.inc_value("scheduler/enqueued/memory", spider=self.spider)
+        else:
+            self.frontier.push(request.priority, data)
+            self.stats.inc_value("scheduler/enqueued/frontier", spider=self.spider)
+        self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        return True
+
+    def has_pending_requests(self) -> bool:
+        if super().has_pending_requests() or self.frontier.pending():
+            return True
+
+        # Nothing left, but the busy workers can still enqueue requests.
+        if not self._idle:
+            self.frontier.set_busy(self.worker, False)
+            self._idle = True
+        if self.frontier.finished():
+            return False
+        self._schedule_poll()
+        return True
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self._taken)
+
+    def _dqpop(self) -> Optional[Request]:
+        # Called by Scheduler.next_request once the memory queue is empty.
+        request = super()._dqpop()
+        if request is None and self.frontier is not None:
+            request = self._pop_frontier()
+        return request
+
+    def _pop_frontier(self) -> Optional[Request]:
+        if not self._taken:
+            for data in self.frontier.pop(self.worker, self.batch_size):
+                self._taken.append(request_from_dict(pickle.loads(data), spider=self.spider))
+        if not self._taken:
+            return None
+
+        self._idle = False
+        self.stats.inc_value("scheduler/dequeued/frontier", spider=self.spider)
+        return self._taken.popleft()
+
+    def _schedule_poll(self) -> None:
+        """Wake the engine up in a moment to poll the frontier, instead of waiting for its heartbeat."""
+        if self._poll is None or not self._poll.active():
+            self._poll = reactor.callLater(self.poll_interval, self._poll_frontier)
+
+    def _poll_frontier(self) -> None:
+        self._poll = None
+        slot = getattr(self.crawler.engine, "_slot", None)
+        if slot is not None:
+            slot.nextcall.schedule()
+
+
+def worker_path(path: str, worker: int) -> str:
+    """Path of the file of a worker, e.g. results-2.csv for results.csv."""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}-{worker}{path.suffix}"))
+
+
+def split_cities(cities: List[str], workers: int) -> List[List[str]]:
+    """Split the cities between the workers, which start with their first listing page."""
+    return [cities[worker::workers] for worker in range(workers)]
+
+
+def merge_csv(paths: List[str], output: str) -> int:
+    """Merge the CSV files of the workers into output, and return the number of rows."""
+    rows = 0
+    with open(output, "w", newline="") as merged:
+        writer = None
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                if writer is None:
+                    writer = csv.writer(merged)
+                    writer.writerow(header)
+                for row in reader:
+                    writer.writerow(row)
+                    rows += 1
+            os.remove(path)
+    return rows
+
+
+def crawl(spider: str, workers: int, spider_args: List[Tuple[str, str]], settings: List[Tuple[str, str]],
+          frontier: str = "frontier.db", output: str = "results.csv") -> int:
+    """Run the spider in *workers* processes sharing a frontier, and merge their CSV outputs into output.
+
+    Return the exit status: 0, or the status of the first worker which failed.
+    """
+    shared = Frontier.create(frontier, workers)
+
+    args = dict(spider_args)
+    cities = args.pop("cities", None)
+    shares = split_cities(cities.split(","), workers) if cities else [None] + [[]] * (workers - 1)
+    options = dict(settings)
+
+    processes = []
+    for worker in range(workers):
+        command = [sys.executable, "-m", "scrapy", "crawl", spider]
+        for name, value in args.items():
+            command += ["-a", f"{name}={value}"]
+        if shares[worker] is not None:
+            # Without cities, the worker only takes requests from the frontier.
+            command += ["-a", "cities=" + ",".join(shares[worker])]
+
+        worker_settings = dict(
+            options,
+            DISTRIBUTED_ENABLED=True,
+            DISTRIBUTED_WORKER=worker,
+            DISTRIBUTED_FRONTIER=frontier,
+            SCHEDULER="scrapers.distributed.FrontierScheduler",
+            DUPEFILTER_CLASS="scrapers.distributed.FrontierDupeFilter",
+            CSV_FILE=worker_path(output, worker),
+        )
+        for name in ("INCREMENTAL_PATH", "HOTEL_INDEX_PATH", "JOBDIR"):
+            if name in options:
+                worker_settings[name] = worker_path(options[name], worker)
+        for name, value in worker_settings.items():
+            command += ["-s", f"{name}={value}"]
+
+        processes.append(subprocess.Popen(command, env=dict(os.environ, SCRAPY_SETTINGS_MODULE="scrapers.settings")))
+
+    try:
+        status = wait(processes, shared)
+    finally:
+        shared.close()
+    merge_csv([worker_path(output, worker) for worker in range(workers)], output)
+    return status
+
+
+def wait(processes: List[subprocess.Popen], frontier: Frontier, interval: float = 0.5) -> int:
+    """Wait for the workers, and return 0 or the status of the first one which failed.
+
+    A worker which exits is marked as idle, in case it was killed while busy: the other workers would
+    wait for it forever. The crawl fails with the first worker which fails, and the other ones are
+    stopped: the sessions it had taken from the frontier are lost.
+    """
+    running = dict(enumerate(processes))
+    status = 0
+    while running:
+        for worker, process in list(running.items()):
+            code = process.poll()
+            if code is None:
+                continue
+
+            del running[worker]
+            frontier.set_busy(worker, False)
+            if code and not status:
+                # A negative code is the signal which killed the process.
+                status = code if code > 0 else 128 - code
+                print(f"Worker {worker} exited with status {code}, stopping the crawl", file=sys.stderr)
+                for other in running.values():
+                    other.terminate()
+        if running:
+            time.sleep(interval)
+    return status
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a spider in several processes sharing a frontier.")
+    parser.add_argument("spider", nargs="?", default="trekky")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--frontier", default="frontier.db", help="path of the SQLite frontier")
+    parser.add_argument("--output", default="results.csv", help="path of the merged CSV file")
+    parser.add_argument("-a", dest="spider_args", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("-s", dest="settings", action="append", default=[], metavar="NAME=VALUE")
+    args = parser.parse_args()
+
+    def pairs(values):
+        return [tuple(value.split("=", 1)) for value in values]
+
+    return crawl(args.spider, max(1, args.workers), pairs(args.spider_args), pairs(args.settings),
+                 frontier=args.frontier, output=args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
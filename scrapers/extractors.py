@@ -0,0 +1,66 @@
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+from scrapers.items import HotelItem, HotelItemLoader, ReviewItemLoader, ReviewList
+
+
+def compile_css(query):
+    """Compile a CSS query once, with the same translation as parsel's Selector.css()."""
+    return etree.XPath(HTMLTranslator().css_to_xpath(query), smart_strings=False)
+
+
+HOTEL_NAME = compile_css('.hotel-name::text')
+HOTEL_EMAIL = compile_css('.hotel-email::text')
+HOTEL_REVIEWS = compile_css('.hotel-review')
+REVIEW_RATING = compile_css('.review-rating::text')
+
+
+def take_first_stripped(texts):
+    """Same as MapCompose(str.strip) followed by TakeFirst()."""
+    for text in texts:
+        text = text.strip()
+        if text:
+            return text
+    return None
+
+
+def extract_ratings(root):
+    """Extract the rating of every review of a hotel page. A review without rating gets None."""
+    ratings = []
+    for review_el in HOTEL_REVIEWS(root):
+        texts = REVIEW_RATING(review_el)
+        # Same as MapCompose(str.strip, float) followed by TakeFirst(): every value is converted.
+        values = [float(text.strip()) for text in texts]
+        ratings.append(values[0] if values else None)
+    return ratings
+
+
+def extract_hotel(root):
+    """Build the HotelItem of a hotel page from its lxml root, without item loaders.
+
+    The output is identical to the one of HotelItemLoader and ReviewItemLoader.
+    """
+    reviews = ReviewList(extract_ratings(root))
+
+    return HotelItem(
+        name=take_first_stripped(HOTEL_NAME(root)),
+        email=take_first_stripped(HOTEL_EMAIL(root)),
+        reviews=reviews or None,
+    )
+
+
+def load_review(review_el):
+    """Extract the rating of a review with ReviewItemLoader."""
+    review = ReviewItemLoader(selector=review_el)
+    review.add_css('rating', '.review-rating::text')
+    return review.load_item()
+
+
+def load_hotel(selector):
+    """Build the HotelItem of a hotel page from its Selector, with the item loaders."""
+    reviews = [load_review(review_el) for review_el in selector.css('.hotel-review')]
+
+    hotel = HotelItemLoader(selector=selector)
+    hotel.add_css('name', '.hotel-name::text')
+    hotel.add_css('email', '.hotel-email::text')
+    hotel.add_value('reviews', reviews)
+    return hotel.load_item()
@@ -0,0 +1,172 @@
+"""
+An HTTP download handler which sets the connections up per session.
+
+Scrapy's HTTP/1.1 handler shares one connection pool and one TLS context factory between all the
+requests. This handler gives each session (host, cookiejar and proxy, see
+scrapers.middlewares.throttle.get_session_key) its own, so connection and TLS session reuse never
+crosses sessions or proxy exits:
+- with KEEPALIVE_ENABLED, each session keeps its connections alive in its own pool, and the
+  ``Connection: close`` header the spiders send to avoid reuse altogether is dropped;
+- with TLS_SESSION_RESUMPTION, each session resumes its TLS sessions on the next connections to the
+  same host, which keeps the request pattern the site sees while cutting the handshake cost (see
+  scrapers.tls).
+The pools and the TLS sessions of the KEEPALIVE_MAX_SESSIONS sessions used last are kept, the
+others are dropped and their idle connections closed, as sessions come and go during a long crawl.
+It also looks the target and proxy hosts up when the spider opens, and gives the stats to the
+DNS resolver if it is scrapers.resolver.TTLCachingResolver.
+
+You can change the behaviour of this handler by modifying the scraping settings:
+KEEPALIVE_ENABLED - whether to keep connections alive (otherwise, they are closed after each request)
+KEEPALIVE_IDLE_TIMEOUT - seconds after which an idle connection is closed
+KEEPALIVE_MAX_REQUESTS - number of requests after which a connection is closed (0 for no limit)
+KEEPALIVE_MAX_SESSIONS - number of sessions whose pool and TLS sessions are kept (0 for no limit)
+TLS_SESSION_RESUMPTION - whether to resume the TLS sessions
+DNS_PRERESOLVE - whether to look the hosts up when the spider opens
+DNS_PRERESOLVE_HOSTS - hosts looked up besides the host of the spider's start_url and the proxies
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Optional, Set, TypeVar
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler, ScrapyAgent
+from scrapy.core.downloader.tls import openssl_methods
+from scrapy.crawler import Crawler
+from scrapy.http import Response
+from scrapy.http.request import Request
+from scrapy.settings import BaseSettings
+from scrapy.spiders import Spider
+from twisted.internet.defer import Deferred
+from twisted.web.client import HTTPConnectionPool
+
+from scrapers.middlewares.throttle import get_session_key
+from scrapers.resolver import TTLCachingResolver
+from scrapers.tls import SessionResumingContextFactory
+
+T = TypeVar("T")
+
+
+class KeepAliveConnectionPool(HTTPConnectionPool):
+    """A persistent connection pool which closes the connections after *max_requests* requests."""
+
+    def __init__(self, reactor, max_requests: int = 0):
+        super().__init__(reactor, persistent=True)
+        self.max_requests = max_requests
+        self._requests = WeakKeyDictionary()
+
+    def _putConnection(self, key, connection) -> None:
+        # A connection is put back in the pool after each response.
+        count = self._requests.get(connection, 0) + 1
+        if self.max_requests and count >= self.max_requests:
+            self._requests.pop(connection, None)
+            connection.transport.loseConnection()
+            return
+
+        self._requests[connection] = count
+        super()._putConnection(key, connection)
+
+
+class SessionDownloadHandler(HTTP11DownloadHandler):
+    def __init__(self, settings: BaseSettings, crawler: Crawler):
+        super().__init__(settings, crawler)
+        self.keepalive = settings.getbool("KEEPALIVE_ENABLED")
+        self.idle_timeout = settings.getfloat("KEEPALIVE_IDLE_TIMEOUT", 30.0)
+        self.max_requests = settings.getint("KEEPALIVE_MAX_REQUESTS", 100)
+        self.max_per_host = settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN")
+        self.max_sessions = settings.getint("KEEPALIVE_MAX_SESSIONS", 1000)
+        self.tls_resumption = settings.getbool("TLS_SESSION_RESUMPTION")
+        self.tls_method = openssl_methods[settings.get("DOWNLOADER_CLIENT_TLS_METHOD")]
+        self.preresolve = settings.getbool("DNS_PRERESOLVE", True)
+        self.preresolve_hosts: Set[str] = set(settings.getlist("DNS_PRERESOLVE_HOSTS"))
+        for proxy in settings.getlist("SESSION_POOL_PROXIES") + settings.getlist("RETRY_AT_END_PROXIES"):
+            self.preresolve_hosts.add(urlsplit(proxy if "//" in proxy else f"//{proxy}").hostname)
+
+        # Least recently used first.
+        self._pools: OrderedDict[str, KeepAliveConnectionPool] = OrderedDict()
+        self._context_factories: OrderedDict[str, SessionResumingContextFactory] = OrderedDict()
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+
+    def spider_opened(self, spider: Spider) -> None:
+        from twisted.internet import reactor
+
+        if isinstance(reactor.resolver, TTLCachingResolver):
+            reactor.resolver.stats = self._crawler.stats
+        if not self.preresolve:
+            return
+
+        hosts = set(self.preresolve_hosts)
+        if getattr(spider, "start_url", None):
+            hosts.add(urlsplit(spider.start_url).hostname)
+        for host in hosts - {None}:
+            reactor.resolve(host).addErrback(
+                lambda failure, host=host: spider.logger.warning(
+                    "Could not look %s up: %s", host, failure.getErrorMessage()
+                )
+            )
+
+    def download_request(self, request: Request, spider: Spider) -> Deferred[Response]:
+        if not self.keepalive and not self.tls_resumption:
+            return super().download_request(request, spider)
+
+        key = get_session_key(request)
+        if self.keepalive and request.headers.get(b"Connection", b"").lower() == b"close":
+            del request.headers[b"Connection"]
+
+        agent = ScrapyAgent(
+            contextFactory=self._get_context_factory(key) if self.tls_resumption else self._contextFactory,
+            pool=self._get_pool(key) if self.keepalive else self._pool,
+            maxsize=getattr(spider, "download_maxsize", self._default_maxsize),
+            warnsize=getattr(spider, "download_warnsize", self._default_warnsize),
+            fail_on_dataloss=self._fail_on_dataloss,
+            crawler=self._crawler,
+        )
+        return agent.download_request(request)
+
+    def close(self) -> Deferred[None]:
+        for pool in self._pools.values():
+            pool.closeCachedConnections()
+        return super().close()
+
+    def _get_pool(self, key: str) -> KeepAliveConnectionPool:
+        pool = self._touch(self._pools, key)
+        if pool is None:
+            from twisted.internet import reactor
+
+            pool = self._pools[key] = KeepAliveConnectionPool(reactor, self.max_requests)
+            pool.maxPersistentPerHost = self.max_per_host
+            pool.cachedConnectionTimeout = self.idle_timeout
+            pool._factory.noisy = False
+            self._crawler.stats.inc_value("keepalive/pools")
+            evicted = self._evict(self._pools)
+            if evicted is not None:
+                # The connections in use are closed by the idle timeout once put back.
+                evicted.closeCachedConnections()
+                self._crawler.stats.inc_value("keepalive/pools_evicted")
+        return pool
+
+    def _get_context_factory(self, key: str) -> SessionResumingContextFactory:
+        factory = self._touch(self._context_factories, key)
+        if factory is None:
+            factory = self._context_factories[key] = SessionResumingContextFactory.from_crawler(
+                self._crawler, self.tls_method, stats=self._crawler.stats
+            )
+            self._evict(self._context_factories)
+        return factory
+
+    @staticmethod
+    def _touch(cache: OrderedDict[str, T], key: str) -> Optional[T]:
+        """Return the value of a session, marked as used last, or None."""
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _evict(self, cache: OrderedDict[str, T]) -> Optional[T]:
+        """Drop the least recently used session beyond KEEPALIVE_MAX_SESSIONS, and return its value."""
+        if self.max_sessions and len(cache) > self.max_sessions:
+            return cache.popitem(last=False)[1]
+        return None
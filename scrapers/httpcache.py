@@ -0,0 +1,109 @@
+"""
+HTTP cache policy and storage for re-crawls, to use with Scrapy's HttpCacheMiddleware.
+
+HotelPagesPolicy caches the responses of the requests of HTTPCACHE_CALLBACKS only (the hotel pages
+by default). Cached responses are revalidated on every crawl (HTTPCACHE_ALWAYS_REVALIDATE) with
+If-None-Match and If-Modified-Since: a 304 is answered with the cached response, which goes straight
+to the callback, and only changed pages are downloaded in full.
+
+EvictingFilesystemCacheStorage stores the responses like FilesystemCacheStorage, keyed by the request
+fingerprint, and removes the entries unused for HTTPCACHE_MAX_AGE seconds and then the least recently
+used ones until the cache fits in HTTPCACHE_MAX_SIZE_MB, when the spider opens and closes.
+Set HTTPCACHE_GZIP to compress them.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from scrapy.extensions.httpcache import FilesystemCacheStorage, RFC2616Policy
+from scrapy.http import Response
+from scrapy.http.request import Request
+from scrapy.settings import BaseSettings
+from scrapy.spiders import Spider
+
+
+class HotelPagesPolicy(RFC2616Policy):
+    def __init__(self, settings: BaseSettings):
+        super().__init__(settings)
+        self.callbacks = set(settings.getlist("HTTPCACHE_CALLBACKS", ["parse_hotel"]))
+        self.always_revalidate = settings.getbool("HTTPCACHE_ALWAYS_REVALIDATE", True)
+
+    def should_cache_request(self, request: Request) -> bool:
+        return getattr(request.callback, "__name__", None) in self.callbacks and super().should_cache_request(request)
+
+    def is_cached_response_fresh(self, cachedresponse: Response, request: Request) -> bool:
+        if self.always_revalidate:
+            self._set_conditional_validators(request, cachedresponse)
+            return False
+        return super().is_cached_response_fresh(cachedresponse, request)
+
+
+class EvictingFilesystemCacheStorage(FilesystemCacheStorage):
+    def __init__(self, settings: BaseSettings):
+        super().__init__(settings)
+        self.max_age = settings.getfloat("HTTPCACHE_MAX_AGE", 0)
+        self.max_size = settings.getfloat("HTTPCACHE_MAX_SIZE_MB", 0) * 1024 * 1024
+
+    def open_spider(self, spider: Spider) -> None:
+        super().open_spider(spider)
+        self.evict(spider)
+
+    def close_spider(self, spider: Spider) -> None:
+        super().close_spider(spider)
+        self.evict(spider)
+
+    def retrieve_response(self, spider: Spider, request: Request) -> Optional[Response]:
+        response = super().retrieve_response(spider, request)
+        if response is not None:
+            # The modification time of the entry directory is its last use, for the eviction.
+            os.utime(self._get_request_path(spider, request))
+        return response
+
+    def evict(self, spider: Spider) -> None:
+        if not self.max_age and not self.max_size:
+            return
+
+        entries = self._scan(Path(self.cachedir, spider.name))
+        stats = spider.crawler.stats
+        now = time.time()
+
+        kept = []
+        for last_used, size, path in entries:
+            if self.max_age and now - last_used > self.max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                stats.inc_value("httpcache/evicted/age", spider=spider)
+            else:
+                kept.append((last_used, size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if self.max_size and total > self.max_size:
+            kept.sort()
+            for _, size, path in kept:
+                shutil.rmtree(path, ignore_errors=True)
+                stats.inc_value("httpcache/evicted/size", spider=spider)
+                total -= size
+                if total <= self.max_size:
+                    break
+
+        stats.set_value("httpcache/size_mb", round(total / 1024 / 1024, 2), spider=spider)
+
+    @staticmethod
+    def _scan(root: Path) -> List[Tuple[float, int, str]]:
+        """Return the last use, size and path of the entries of the cache directory of a spider."""
+        entries = []
+        if not root.is_dir():
+            return entries
+
+        for prefix in os.scandir(root):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_dir():
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+        return entries
@@ -0,0 +1,116 @@
+"""
+State of the incremental crawls: what the listing pages looked like at the last crawl.
+
+For each listing page, a digest of its ordered hotel links and review counts is stored, and for
+each hotel, its review count as shown on the listing. A hotel is only followed if it is new or if
+its listing entry changed, and a listing page whose digest didn't change is skipped as a whole.
+
+Hotel entries are only recorded once the hotel page is parsed, so a hotel which failed is followed
+again at the next crawl, and a page digest is only recorded once all its hotels are up to date: right
+away if none of them changed, or once the last of the hotels followed is parsed, full crawls included.
+Every INCREMENTAL_FULL_REFRESH_DAYS days, or with the ``full`` spider argument, every hotel is followed.
+
+You can change the behaviour of the incremental mode by modifying the scraping settings:
+INCREMENTAL_ENABLED - whether to enable it
+INCREMENTAL_PATH - path of the dbm file storing the digests
+INCREMENTAL_FULL_REFRESH_DAYS - days between two full crawls (0 to never force one)
+"""
+
+import dbm
+import hashlib
+import time
+
+from scrapy import signals
+
+
+LAST_FULL_CRAWL_KEY = b'__last_full_crawl__'
+
+
+class ListingDigests:
+    def __init__(self, path, full_refresh_every=7 * 86400, force_full=False):
+        self.path = path
+        self.stats = None
+        self.full_refresh_every = full_refresh_every
+        self.force_full = force_full
+        self.full = True
+        self.db = None
+        # Digest and hotel URLs still to parse of the listing pages whose hotels were followed, and the
+        # listing pages of each of these hotels.
+        self._pending_pages = {}
+        self._hotel_pages = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, force_full=False):
+        settings = crawler.settings
+        digests = cls(
+            settings.get('INCREMENTAL_PATH', 'incremental.db'),
+            full_refresh_every=settings.getfloat('INCREMENTAL_FULL_REFRESH_DAYS', 7) * 86400,
+            force_full=force_full,
+        )
+        crawler.signals.connect(digests.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(digests.spider_closed, signal=signals.spider_closed)
+        return digests
+
+    def spider_opened(self, spider):
+        self.stats = spider.crawler.stats
+        self.db = dbm.open(self.path, 'c')
+
+        last_full = float(self.db.get(LAST_FULL_CRAWL_KEY, b'0'))
+        self.full = (
+            self.force_full
+            or not last_full
+            or (self.full_refresh_every > 0 and time.time() - last_full >= self.full_refresh_every)
+        )
+        spider.logger.info("%s crawl, using %s", "Full" if self.full else "Incremental", self.path)
+        self.stats.set_value('incremental/full', self.full)
+
+    def spider_closed(self, spider, reason):
+        if self.full and reason == 'finished':
+            self.db[LAST_FULL_CRAWL_KEY] = str(time.time())
+        self.db.close()
+
+    @staticmethod
+    def page_digest(entries):
+        """Digest of the ordered (hotel URL, review count) entries of a listing page."""
+        data = '\n'.join(f'{url}\t{reviews_count or ""}' for url, reviews_count in entries)
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+    def filter_entries(self, page_key, entries):
+        """Return the entries of the listing page whose hotel must be followed."""
+        digest = self.page_digest(entries)
+        if not self.full and self.db.get(b'page:' + page_key.encode('utf-8')) == digest:
+            self.stats.inc_value('incremental/pages_unchanged')
+            self.stats.inc_value('incremental/skipped', len(entries))
+            return []
+
+        changed = [entry for entry in entries if self.full or self._entry_changed(*entry)]
+        if changed:
+            self._pending_pages[page_key] = (digest, {url for url, _ in changed})
+            for url, _ in changed:
+                self._hotel_pages.setdefault(url, set()).add(page_key)
+        else:
+            self._record_page(page_key, digest)
+
+        self.stats.inc_value('incremental/followed', len(changed))
+        self.stats.inc_value('incremental/skipped', len(entries) - len(changed))
+        return changed
+
+    def record_entry(self, url, reviews_count):
+        """Record the listing entry of a hotel once its page has been parsed."""
+        self.db[b'hotel:' + url.encode('utf-8')] = (reviews_count or '').encode('utf-8')
+
+        for page_key in self._hotel_pages.pop(url, ()):
+            pending = self._pending_pages.get(page_key)
+            if pending is None:
+                continue
+            digest, urls = pending
+            urls.discard(url)
+            if not urls:
+                del self._pending_pages[page_key]
+                self._record_page(page_key, digest)
+
+    def _record_page(self, page_key, digest):
+        self.db[b'page:' + page_key.encode('utf-8')] = digest
+
+    def _entry_changed(self, url, reviews_count):
+        return self.db.get(b'hotel:' + url.encode('utf-8')) != (reviews_count or '').encode('utf-8')
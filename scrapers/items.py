@@ -1,9 +1,12 @@
+from array import array
 from dataclasses import dataclass, field
+from itemadapter import ItemAdapter
 from itemloaders.processors import TakeFirst, MapCompose, Identity
+from math import isnan, nan
 from scrapy.loader import ItemLoader
 
 
-@dataclass
+@dataclass(slots=True)
 class ReviewItem:
     rating: float = field(default=None)
 
@@ -14,11 +17,63 @@ class ReviewItemLoader(ItemLoader):
     rating_out = TakeFirst()
 
 
-@dataclass
+class ReviewList:
+    """The reviews of a hotel, stored as a compact array of ratings (8 bytes per review).
+
+    It behaves as a read-only sequence of ReviewItem, which are created on access.
+    A missing rating is stored as NaN.
+    """
+    __slots__ = ('ratings',)
+
+    def __init__(self, ratings=()):
+        self.ratings = array('d', (nan if rating is None else rating for rating in ratings))
+
+    @classmethod
+    def from_reviews(cls, reviews):
+        return cls(ItemAdapter(review).get('rating') for review in reviews)
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            reviews = ReviewList()
+            reviews.ratings = self.ratings[index]
+            return reviews
+        return ReviewItem(rating=self._value(self.ratings[index]))
+
+    def __iter__(self):
+        for rating in self.ratings:
+            yield ReviewItem(rating=self._value(rating))
+
+    def __eq__(self, other):
+        if isinstance(other, ReviewList):
+            return self.values() == other.values()
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ReviewList({self.values()!r})"
+
+    def values(self):
+        """Return the ratings as a list of floats, with None for missing ratings."""
+        return [self._value(rating) for rating in self.ratings]
+
+    def to_list(self):
+        """Return the reviews in the dict form used by the pipelines: [{'rating': 4.5}, ...]."""
+        return [{'rating': self._value(rating)} for rating in self.ratings]
+
+    @staticmethod
+    def _value(rating):
+        return None if isnan(rating) else rating
+
+
+@dataclass(slots=True)
 class HotelItem:
     name: str = field(default=None)
     email: str = field(default=None)
-    reviews: list[ReviewItem] = field(default=None)
+    reviews: ReviewList = field(default=None)
 
 
 class HotelItemLoader(ItemLoader):
@@ -27,5 +82,15 @@ class HotelItemLoader(ItemLoader):
     default_item_class = HotelItem
 
     reviews_in = Identity()
-    reviews_out = Identity()
+    reviews_out = ReviewList.from_reviews
+
+
+def item_to_dict(item):
+    """Convert an item to a dict of plain values, with the reviews as a list of dicts."""
+    data = ItemAdapter(item).asdict()
+
+    reviews = data.get('reviews')
+    if isinstance(reviews, ReviewList):
+        data['reviews'] = reviews.to_list()
 
+    return data
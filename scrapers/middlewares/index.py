@@ -0,0 +1,77 @@
+from itemadapter import ItemAdapter, is_item
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured
+from scrapers.index import HashIndex
+from w3lib.url import canonicalize_url
+
+
+class HotelIndexSpiderMiddleware:
+    ###This spider middleware class remembers the hotels already extracted, across runs.###
+    # Hotel pages (requests to the HOTEL_INDEX_CALLBACK callback) whose URL is in the index are skipped before
+    # they reach the scheduler, and hotel items whose email is in the index are dropped.
+    # The index is stored in HOTEL_INDEX_PATH and updated when the spider is closed.
+    def __init__(self, stats, path, callback_name):
+        self.stats = stats
+        self.callback_name = callback_name
+        self.index = HashIndex(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('HOTEL_INDEX_ENABLED'):
+            raise NotConfigured
+
+        s = cls(
+            crawler.stats,
+            settings.get('HOTEL_INDEX_PATH', 'hotels.idx'),
+            settings.get('HOTEL_INDEX_CALLBACK', 'parse_hotel'),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        spider.logger.info("Hotel index loaded with %d keys", len(self.index))
+
+    def spider_closed(self, spider):
+        self.index.save()
+        self.index.close()
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            if self._keep(response, x):
+                yield x
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for x in result:
+            if self._keep(response, x):
+                yield x
+
+    def _keep(self, response, x):
+        if isinstance(x, Request):
+            if self._is_hotel(x) and self._url_key(x.url) in self.index:
+                self.stats.inc_value('hotel_index/requests_skipped')
+                return False
+            return True
+
+        if not is_item(x):
+            return True
+
+        email = ItemAdapter(x).get('email')
+        if email and not self.index.add('email:' + email.lower()):
+            self.stats.inc_value('hotel_index/items_dropped')
+            return False
+
+        if self._is_hotel(response.request):
+            self.index.add(self._url_key(response.request.url))
+
+        self.stats.inc_value('hotel_index/items_added')
+        return True
+
+    def _is_hotel(self, request):
+        callback = getattr(request, 'callback', None)
+        return getattr(callback, '__name__', None) == self.callback_name
+
+    @staticmethod
+    def _url_key(url):
+        return 'url:' + canonicalize_url(url)
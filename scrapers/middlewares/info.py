@@ -1,20 +1,196 @@
-from scrapy import signals
+from functools import wraps
+from itemadapter import is_item
+from scrapy import Request, signals
+from twisted.internet import task
+
+import inspect
+import time
+
+
+TIME_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+SIZE_BUCKETS_KB = (1, 4, 16, 64, 256, 1024, 4096)
+
+
+def bucket(value, buckets):
+    """Return the histogram bucket label of the value."""
+    for limit in buckets:
+        if value <= limit:
+            return f"le_{limit}"
+    return f"gt_{buckets[-1]}"
+
+
+def record_duration(stats, prefix, ms):
+    """Record a duration (in milliseconds) in the stats, as a histogram, a total and a maximum."""
+    stats.inc_value(f"{prefix}/{bucket(ms, TIME_BUCKETS_MS)}")
+    stats.inc_value(f"{prefix}/total", ms)
+    stats.max_value(f"{prefix}/max", ms)
+
+
+def record_timing(stats, name, wall, cpu):
+    """Record the wall and CPU time (in seconds) of a callback in the stats, as histograms and totals."""
+    wall_ms = wall * 1000
+    cpu_ms = cpu * 1000
+    prefix = f"info/callback/{name}"
+
+    stats.inc_value(f"{prefix}/calls")
+    stats.inc_value(f"{prefix}/wall_ms/{bucket(wall_ms, TIME_BUCKETS_MS)}")
+    stats.inc_value(f"{prefix}/cpu_ms/{bucket(cpu_ms, TIME_BUCKETS_MS)}")
+    stats.inc_value(f"{prefix}/wall_ms/total", wall_ms)
+    stats.inc_value(f"{prefix}/cpu_ms/total", cpu_ms)
+    stats.max_value(f"{prefix}/wall_ms/max", wall_ms)
+
+
+def instrumented(method):
+    """Decorator recording the wall and CPU time of a spider callback or errback in the stats.
+
+    For generator callbacks, only the time spent producing the values is counted.
+    """
+    name = method.__name__
+
+    def timed_iter(spider, iterator):
+        wall = cpu = 0.0
+        try:
+            while True:
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                try:
+                    value = next(iterator)
+                finally:
+                    wall += time.perf_counter() - wall_start
+                    cpu += time.thread_time() - cpu_start
+                yield value
+        except StopIteration:
+            pass
+        finally:
+            record_timing(spider.crawler.stats, name, wall, cpu)
+
+    if inspect.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(spider, *args, **kwargs):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return await method(spider, *args, **kwargs)
+            finally:
+                record_timing(spider.crawler.stats, name, time.perf_counter() - wall, time.thread_time() - cpu)
+        return async_wrapper
+
+    @wraps(method)
+    def wrapper(spider, *args, **kwargs):
+        if inspect.isgeneratorfunction(method):
+            return timed_iter(spider, method(spider, *args, **kwargs))
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return method(spider, *args, **kwargs)
+        finally:
+            record_timing(spider.crawler.stats, name, time.perf_counter() - wall, time.thread_time() - cpu)
+    return wrapper
+
 
 class InfoSpiderMiddleware:
     ###This spider middleware class logs the number of scraped items when the spider is closed.###
-    def __init__(self, stats):
+    # It also records in the stats the number of items and requests yielded by each callback,
+    # and the response body size distribution. Callback timings come from the @instrumented decorator.
+    # Every INFO_INTERVAL seconds, it logs the throughput and the number of requests in flight and scheduled.
+    def __init__(self, stats, interval=60.0):
         self.stats = stats
+        self.interval = interval
+        self.crawler = None
+
+        self._task = None
+        self._last = (0, 0)
 
     @classmethod
     def from_crawler(cls, crawler):
-        s = cls(crawler.stats)
+        s = cls(crawler.stats, crawler.settings.getfloat("INFO_INTERVAL", 60.0))
+        s.crawler = crawler
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def spider_opened(self, spider):
+        if self.interval > 0:
+            self._task = task.LoopingCall(self.log_throughput, spider)
+            self._task.start(self.interval, now=False)
+
     def spider_closed(self, spider):
+        if self._task and self._task.running:
+            self._task.stop()
+
         count = self.stats.get_value("item_scraped_count", 0, spider=spider)
         if count > 0:
             if count > 1:
                 spider.logger.info(f"\n\nWe got: {count} items\n")
             else:
                 spider.logger.info("\n\nWe got: 1 item\n")
+
+    def log_throughput(self, spider):
+        pages = self.stats.get_value("response_received_count", 0)
+        items = self.stats.get_value("item_scraped_count", 0)
+        pages_rate = (pages - self._last[0]) * 60 / self.interval
+        items_rate = (items - self._last[1]) * 60 / self.interval
+        self._last = (pages, items)
+
+        in_flight = len(self.crawler.engine.downloader.active) if self.crawler.engine else 0
+        self.stats.max_value("info/in_flight/max", in_flight)
+        slot = getattr(self.crawler.engine, "_slot", None)
+        scheduled = len(slot.scheduler) if slot is not None else 0
+        self.stats.max_value("info/scheduled/max", scheduled)
+
+        spider.logger.info(
+            "Throughput: %(pages).0f pages/min, %(items).0f items/min, %(in_flight)d requests in flight, "
+            "%(scheduled)d scheduled",
+            {"pages": pages_rate, "items": items_rate, "in_flight": in_flight, "scheduled": scheduled},
+        )
+
+    def process_spider_input(self, response, spider):
+        size_kb = len(response.body) / 1024
+        self.stats.inc_value(f"info/response_bytes/{bucket(size_kb, SIZE_BUCKETS_KB)}")
+        self.stats.max_value("info/response_bytes/max", len(response.body))
+
+    def process_spider_output(self, response, result, spider):
+        name, items, requests = self._callback_name(response, spider), 0, 0
+        try:
+            for x in result:
+                if isinstance(x, Request):
+                    requests += 1
+                elif is_item(x):
+                    items += 1
+                yield x
+        finally:
+            self._record(name, items, requests)
+
+    async def process_spider_output_async(self, response, result, spider):
+        name, items, requests = self._callback_name(response, spider), 0, 0
+        try:
+            async for x in result:
+                if isinstance(x, Request):
+                    requests += 1
+                elif is_item(x):
+                    items += 1
+                yield x
+        finally:
+            self._record(name, items, requests)
+
+    def _callback_name(self, response, spider):
+        request = response.request
+        if self._is_error(response, spider) and request.errback:
+            return request.errback.__name__
+
+        callback = request.callback or spider.parse
+        return getattr(callback, "__name__", "parse")
+
+    @staticmethod
+    def _is_error(response, spider):
+        """Same rules as HttpErrorMiddleware: the response is sent to the errback instead of the callback."""
+        if 200 <= response.status < 300:
+            return False
+        meta = response.meta
+        if meta.get("handle_httpstatus_all", False):
+            return False
+        allowed = meta.get("handle_httpstatus_list", getattr(spider, "handle_httpstatus_list", ()))
+        return response.status not in allowed
+
+    def _record(self, name, items, requests):
+        prefix = f"info/callback/{name}"
+        self.stats.inc_value(f"{prefix}/items", items)
+        self.stats.inc_value(f"{prefix}/requests", requests)
@@ -0,0 +1,69 @@
+"""
+A downloader middleware which enforces a request rate per host across all the workers of a
+distributed crawl (see scrapers.distributed), with token buckets kept in the frontier.
+
+Each request takes a token from the bucket of its host, which is refilled at RATE_LIMIT tokens per
+second up to RATE_LIMIT_BURST tokens. When the bucket is empty, the token is reserved anyway and
+the request waits in the scheduler (see scrapers.scheduler.DelayedRequestScheduler) until its turn,
+so the requests of all the workers are spaced out evenly.
+
+You can change the behaviour of this middleware by modifying the scraping settings:
+RATE_LIMIT - requests per second per host across all the workers (0 disables the limit)
+RATE_LIMIT_BURST - number of requests which can be sent at once after an idle period
+"""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Optional
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http.request import Request
+from scrapy.spiders import Spider
+from scrapy.utils.httpobj import urlparse_cached
+
+from scrapers.distributed import Frontier
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+
+class GlobalRateLimitMiddleware:
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        self.rate = settings.getfloat("RATE_LIMIT", 0.0)
+        if not settings.getbool("DISTRIBUTED_ENABLED") or self.rate <= 0:
+            raise NotConfigured
+
+        self.stats = crawler.stats
+        self.burst = max(1.0, settings.getfloat("RATE_LIMIT_BURST", 1.0))
+        self.frontier = Frontier.from_settings(settings)
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> Self:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider: Spider) -> None:
+        self.frontier.close()
+
+    def process_request(self, request: Request, spider: Spider) -> Optional[Request]:
+        # The request already waited for the token it reserved.
+        if request.meta.pop("rate_limit_reserved", False):
+            return None
+
+        wait = self.frontier.reserve(urlparse_cached(request).hostname or "", self.rate, self.burst)
+        if wait <= 0:
+            return None
+
+        self.stats.inc_value("ratelimit/delayed")
+        self.stats.inc_value("ratelimit/wait_ms", int(wait * 1000))
+        waiting = request.copy()
+        waiting.dont_filter = True
+        waiting.meta["delay_until"] = time.time() + wait
+        waiting.meta["rate_limit_reserved"] = True
+        return waiting
@@ -6,16 +6,49 @@ You can change the behaviour of this middleware by modifying the scraping settin
 RETRY_TIMES - how many times to retry a failed page
 RETRY_HTTP_CODES - which HTTP response codes to retry
 
+Retried requests are delayed with an exponential backoff:
+RETRY_BACKOFF_BASE - delay of the first retry, in seconds
+RETRY_BACKOFF_MULTIPLIER - factor applied to the delay at each retry
+RETRY_BACKOFF_MAX - maximum delay, in seconds
+RETRY_BACKOFF_JITTER - "full" (random delay up to the backoff), "decorrelated" or "none"
+The Retry-After header of 429 and 503 responses is honored.
+
+Use scrapers.scheduler.DelayedRequestScheduler as SCHEDULER to keep delayed requests
+out of the downloader while they wait.
+
+Retries can be limited to a fraction of the traffic, per cookiejar session and per domain:
+RETRY_BUDGET_RATIO - maximum ratio of retries to responses (0 disables the budget)
+RETRY_BUDGET_MIN - number of retries always allowed, on top of the ratio
+
+A circuit breaker can stop sending requests to a failing host or session (host, cookiejar and
+proxy, see scrapers.middlewares.throttle.get_session_key):
+CIRCUIT_BREAKER_ENABLED - whether to enable it
+CIRCUIT_BREAKER_WINDOW - number of recent outcomes used to compute the error rate
+CIRCUIT_BREAKER_MIN_CALLS - minimum number of outcomes before the circuit can open
+CIRCUIT_BREAKER_ERROR_RATE - error rate which opens the circuit
+CIRCUIT_BREAKER_OPEN_SECONDS - time before an open circuit lets probe requests through
+CIRCUIT_BREAKER_PROBES - number of successful probes which close the circuit
+While a circuit is open, its requests are parked in the scheduler until it half-opens.
+
 Failed pages are collected on the scraping process and rescheduled at the end,
-once the spider has finished crawling all regular (non failed) pages.
+once the spider has finished crawling all regular (non failed) pages:
+RETRY_AT_END - whether to retry failed pages at the end instead of after their backoff delay
+RETRY_AT_END_COOKIEJARS - cookiejars to cycle through when replaying them
+RETRY_AT_END_PROXIES - proxies to cycle through when replaying them
+This requires scrapers.scheduler.DelayedRequestScheduler, which spills them to disk.
 """
 
 from __future__ import annotations
 
+import random
+import time
 import warnings
+from collections import defaultdict, deque
+from email.utils import parsedate_to_datetime
 from logging import Logger, getLogger
-from typing import TYPE_CHECKING, Any, Optional, Tuple, Type, Union
+from typing import TYPE_CHECKING, Any, Deque, Dict, Optional, Tuple, Type, Union
 
+from scrapy import signals
 from scrapy.crawler import Crawler
 from scrapy.exceptions import NotConfigured, ScrapyDeprecationWarning
 from scrapy.http import Response
@@ -23,12 +56,14 @@ from scrapy.http.request import Request
 from scrapy.settings import BaseSettings, Settings
 from scrapy.spiders import Spider
 from scrapy.utils.misc import load_object
+from scrapy.utils.httpobj import urlparse_cached
 from scrapy.utils.python import global_object_name
 from scrapy.utils.response import response_status_message
-
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 
+from scrapers.middlewares.throttle import get_session_key
+
 if TYPE_CHECKING:
     # typing.Self requires Python 3.11
     from typing_extensions import Self
@@ -64,7 +99,7 @@ def get_retry_request(
     reason: Union[str, Exception, Type[Exception]] = "unspecified",
     max_retry_times: Optional[int] = None,
     priority_adjust: Optional[int] = None,
-    delay: int,
+    delay: float,
     logger: Logger = retry_logger,
     stats_base_key: str = "retry",
 ) -> Optional[Request]:
@@ -107,6 +142,11 @@ def get_retry_request(
 
     *stats_base_key* is a string to be used as the base key for the
     retry-related job stats
+
+    *delay* is the number of seconds to wait before sending the new request. It is
+    stored in the ``delay_until`` meta key as a UNIX timestamp, which
+    :class:`~scrapers.scheduler.DelayedRequestScheduler` uses to hold the request
+    outside of the downloader until it is due.
     """
     settings = spider.crawler.settings
     assert spider.crawler.stats
@@ -130,6 +170,7 @@ def get_retry_request(
         new_request.priority = request.priority + priority_adjust
 
         new_request.meta["delay_request_by"] = delay
+        new_request.meta["delay_until"] = time.time() + delay
 
         if callable(reason):
             reason = reason()
@@ -138,6 +179,8 @@ def get_retry_request(
 
         stats.inc_value(f"{stats_base_key}/count")
         stats.inc_value(f"{stats_base_key}/reason_count/{reason}")
+        stats.inc_value(f"{stats_base_key}/delay_total", delay)
+        stats.max_value(f"{stats_base_key}/delay_max", delay)
         return new_request
     stats.inc_value(f"{stats_base_key}/max_reached")
     logger.error(
@@ -148,6 +191,294 @@ def get_retry_request(
     return None
 
 
+def parse_retry_after(value: Optional[bytes]) -> Optional[float]:
+    """Return the delay in seconds of a Retry-After header (delay-seconds or HTTP-date)."""
+    if not value:
+        return None
+
+    value = value.decode("latin-1").strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class BackoffPolicy:
+    """
+    Computes the delay before a retry: an exponential backoff with jitter, capped by
+    *max_delay*. The Retry-After header of 429 and 503 responses takes precedence when
+    it asks for a longer delay.
+    """
+
+    JITTERS = ("full", "decorrelated", "none")
+
+    def __init__(
+        self,
+        base: float = 20.0,
+        multiplier: float = 2.0,
+        max_delay: float = 300.0,
+        jitter: str = "full",
+        rng: Optional[random.Random] = None,
+    ):
+        if jitter not in self.JITTERS:
+            raise ValueError(f"Unknown backoff jitter {jitter!r}, expected one of {self.JITTERS}")
+        self.base = base
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def from_settings(cls, settings: BaseSettings) -> Self:
+        return cls(
+            base=settings.getfloat("RETRY_BACKOFF_BASE", 20.0),
+            multiplier=settings.getfloat("RETRY_BACKOFF_MULTIPLIER", 2.0),
+            max_delay=settings.getfloat("RETRY_BACKOFF_MAX", 300.0),
+            jitter=settings.get("RETRY_BACKOFF_JITTER", "full"),
+        )
+
+    def get_delay(self, request: Request, response: Optional[Response] = None) -> float:
+        """Return the delay in seconds before retrying *request*, which failed with *response* if any."""
+        attempt = request.meta.get("retry_times", 0)
+
+        # The backoff is capped before the jitter, which would otherwise put most of the retries
+        # beyond the cap at exactly max_delay, in lockstep.
+        if self.jitter == "decorrelated":
+            previous = request.meta.get("delay_request_by") or self.base
+            delay = self.rng.uniform(min(self.base, self.max_delay), min(self.max_delay, previous * 3))
+        else:
+            delay = min(self.max_delay, self.base * self.multiplier ** attempt)
+            if self.jitter == "full":
+                delay = self.rng.uniform(0, delay)
+
+        if response is not None and response.status in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+        return delay
+
+
+class RetryBudget:
+    """
+    Limits the number of retries to a fraction of the responses received, for each key
+    (the cookiejar session and the domain of the request).
+    A retry is allowed while ``retries < min_retries + ratio * responses`` for all keys.
+    """
+
+    def __init__(self, ratio: float, min_retries: int = 10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self._responses: defaultdict[str, int] = defaultdict(int)
+        self._retries: defaultdict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def get_keys(request: Request) -> Tuple[str, ...]:
+        keys = (f"domain/{urlparse_cached(request).hostname}",)
+        cookiejar = request.meta.get("cookiejar")
+        if cookiejar is not None:
+            keys += (f"cookiejar/{cookiejar}",)
+        return keys
+
+    def record_response(self, request: Request) -> None:
+        for key in self.get_keys(request):
+            self._responses[key] += 1
+
+    def try_acquire(self, request: Request) -> Optional[str]:
+        """Count a retry of *request* and return None, or return the exhausted key without counting."""
+        keys = self.get_keys(request)
+        for key in keys:
+            if self._retries[key] >= self.min_retries + self.ratio * self._responses[key]:
+                return key
+
+        for key in keys:
+            self._retries[key] += 1
+        return None
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker with closed, open and half-open states.
+
+    While closed, the outcomes of the last *window_size* requests are kept. The circuit opens
+    when at least *min_calls* of them are known and the error rate reaches *error_rate*.
+    After *open_seconds*, it becomes half-open: up to *probes* requests are let through at
+    a time. The circuit closes after *probes* successful probes, and opens again on a failed one.
+    A probe lasts at most *probe_timeout* seconds, the download timeout: a probe which ended without
+    an outcome (e.g. dropped by another middleware) frees its slot after that time.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        window_size: int = 20,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        open_seconds: float = 60.0,
+        probes: int = 1,
+        probe_timeout: float = 180.0,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.probe_timeout = probe_timeout
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.outcomes: Deque[bool] = deque(maxlen=window_size)
+        # Start times of the probes in flight, oldest first.
+        self.probes_in_flight: Deque[float] = deque()
+        self.probe_successes = 0
+
+    def can_pass(self, now: float) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now >= self.opened_at + self.open_seconds
+        while self.probes_in_flight and self.probes_in_flight[0] + self.probe_timeout <= now:
+            self.probes_in_flight.popleft()
+        return len(self.probes_in_flight) < self.probes
+
+    def acquire(self, now: float) -> Tuple[bool, Optional[str]]:
+        """Let a request through. Return whether it is a probe, and the new state if it changed."""
+        transition = None
+        if self.state == self.OPEN:
+            self.state = transition = self.HALF_OPEN
+            self.probes_in_flight.clear()
+            self.probe_successes = 0
+
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight.append(now)
+            return True, transition
+        return False, transition
+
+    def record(self, success: bool, probe: bool, now: float) -> Optional[str]:
+        """Record the outcome of a request and return the new state if it changed."""
+        if probe and self.state == self.HALF_OPEN:
+            self.release()
+            if not success:
+                return self._open(now)
+
+            self.probe_successes += 1
+            if self.probe_successes >= self.probes:
+                self.state = self.CLOSED
+                self.outcomes.clear()
+                return self.CLOSED
+            return None
+
+        if self.state != self.CLOSED:
+            # Requests sent before the circuit opened.
+            return None
+
+        self.outcomes.append(success)
+        if len(self.outcomes) >= self.min_calls:
+            errors = self.outcomes.count(False)
+            if errors / len(self.outcomes) >= self.error_rate:
+                return self._open(now)
+        return None
+
+    def release(self) -> None:
+        """Free the slot of a probe which ended, with or without an outcome."""
+        if self.state == self.HALF_OPEN and self.probes_in_flight:
+            self.probes_in_flight.popleft()
+
+    def retry_at(self, now: float) -> float:
+        """Return the time until which the requests blocked by the circuit are parked."""
+        if self.state == self.HALF_OPEN:
+            # The probes in flight decide, parking until their outcome is likely known rather than polling.
+            return max(self.opened_at + self.open_seconds, now + min(self.open_seconds, self.probe_timeout))
+        return self.opened_at + self.open_seconds
+
+    def _open(self, now: float) -> str:
+        self.state = self.OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+        return self.OPEN
+
+
+class CircuitBreakers:
+    """The circuit breakers of a crawl, one per host and one per session (host, cookiejar and proxy)."""
+
+    def __init__(self, settings: BaseSettings):
+        self.window_size = settings.getint("CIRCUIT_BREAKER_WINDOW", 20)
+        self.min_calls = settings.getint("CIRCUIT_BREAKER_MIN_CALLS", 10)
+        self.error_rate = settings.getfloat("CIRCUIT_BREAKER_ERROR_RATE", 0.5)
+        self.open_seconds = settings.getfloat("CIRCUIT_BREAKER_OPEN_SECONDS", 60.0)
+        self.probes = settings.getint("CIRCUIT_BREAKER_PROBES", 1)
+        self.probe_timeout = settings.getfloat("DOWNLOAD_TIMEOUT", 180.0)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    @staticmethod
+    def get_keys(request: Request) -> Tuple[str, ...]:
+        keys = (f"host/{urlparse_cached(request).hostname}",)
+        # Without a cookiejar or a proxy, the session is the host.
+        if request.meta.get("cookiejar") is not None or request.meta.get("proxy"):
+            keys += (f"session/{get_session_key(request)}",)
+        return keys
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(
+                self.window_size, self.min_calls, self.error_rate, self.open_seconds, self.probes, self.probe_timeout
+            )
+        return breaker
+
+    def before_request(self, request: Request, spider: Spider) -> Optional[float]:
+        """Return None if the request can be sent, or the time until which it must be parked."""
+        now = time.time()
+        breakers = [(key, self.get(key)) for key in self.get_keys(request)]
+
+        blocked = [breaker for _, breaker in breakers if not breaker.can_pass(now)]
+        if blocked:
+            return max(breaker.retry_at(now) for breaker in blocked)
+
+        probes = []
+        for key, breaker in breakers:
+            probe, transition = breaker.acquire(now)
+            if probe:
+                probes.append(key)
+            self._log_transition(key, transition, spider)
+
+        if probes:
+            request.meta["circuit_probes"] = probes
+        else:
+            request.meta.pop("circuit_probes", None)
+        return None
+
+    def after_request(self, request: Request, success: bool, spider: Spider) -> None:
+        now = time.time()
+        # Popped, so that the probes are only released once.
+        probes = request.meta.pop("circuit_probes", ())
+        for key in self.get_keys(request):
+            transition = self.get(key).record(success, key in probes, now)
+            self._log_transition(key, transition, spider)
+
+    def release(self, request: Request) -> None:
+        """Free the probe slots taken by a request which ended without an outcome."""
+        for key in request.meta.pop("circuit_probes", ()):
+            self.get(key).release()
+
+    def _log_transition(self, key: str, state: Optional[str], spider: Spider) -> None:
+        if state is None:
+            return
+
+        stats = spider.crawler.stats
+        stats.inc_value(f"circuit/transitions/{state}")
+        stats.inc_value(f"circuit/{key}/{state}")
+        log = spider.logger.warning if state == CircuitBreaker.OPEN else spider.logger.info
+        log("Circuit %s is now %s", key, state)
+
+
 class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
     def __init__(self, settings: BaseSettings):
         if not settings.getbool("RETRY_ENABLED"):
@@ -157,6 +488,20 @@ class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
             int(x) for x in settings.getlist("RETRY_HTTP_CODES")
         )
         self.priority_adjust = settings.getint("RETRY_PRIORITY_ADJUST")
+        self.backoff = BackoffPolicy.from_settings(settings)
+
+        budget_ratio = settings.getfloat("RETRY_BUDGET_RATIO", 0.0)
+        self.budget = (
+            RetryBudget(budget_ratio, settings.getint("RETRY_BUDGET_MIN", 10))
+            if budget_ratio > 0
+            else None
+        )
+        self.breakers = (
+            CircuitBreakers(settings)
+            if settings.getbool("CIRCUIT_BREAKER_ENABLED")
+            else None
+        )
+        self.retry_at_end = settings.getbool("RETRY_AT_END")
 
         try:
             self.exceptions_to_retry = self.__getattribute__("EXCEPTIONS_TO_RETRY")
@@ -169,9 +514,40 @@ class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
 
     @classmethod
     def from_crawler(cls, crawler: Crawler) -> Self:
-        return cls(crawler.settings)
+        o = cls(crawler.settings)
+        if o.breakers is not None:
+            crawler.signals.connect(o.request_left_downloader, signal=signals.request_left_downloader)
+        return o
+
+    def request_left_downloader(self, request: Request, spider: Spider) -> None:
+        # The signal is sent before the response goes through process_response, which records the
+        # outcome of the probe: only release the probes it didn't see (e.g. when a later
+        # middleware returned another request).
+        reactor.callLater(0, self.breakers.release, request)
 
     def process_request(self, request, spider):
+        if self.breakers is not None and not request.meta.get("dont_retry", False):
+            park_until = self.breakers.before_request(request, spider)
+            if park_until is not None:
+                # Send the request back to the scheduler, which holds it until the circuit half-opens.
+                spider.crawler.stats.inc_value("circuit/parked")
+                parked = request.copy()
+                parked.dont_filter = True
+                parked.meta["delay_until"] = park_until + random.uniform(0, 1)
+                return parked
+
+        delay_until = request.meta.get('delay_until')
+        if delay_until is not None:
+            # DelayedRequestScheduler only hands the request out once it is due.
+            # Otherwise, wait for the remaining time here (it occupies a download slot).
+            remaining = delay_until - time.time()
+            if remaining <= 0:
+                return
+
+            deferred = Deferred()
+            reactor.callLater(remaining, deferred.callback, None)
+            return deferred
+
         delay_s = request.meta.get('delay_request_by', None)
         if not delay_s:
             return
@@ -189,16 +565,28 @@ class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
     def process_response(
         self, request: Request, response: Response, spider: Spider
     ) -> Union[Request, Response]:
+        if self.budget is not None:
+            self.budget.record_response(request)
+        if self.breakers is not None:
+            self.breakers.after_request(request, response.status not in self.retry_http_codes, spider)
         if request.meta.get("dont_retry", False):
             return response
         if response.status in self.retry_http_codes:
             reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
+            return self._retry(request, reason, spider, response) or response
         return response
 
     def process_exception(
         self, request: Request, exception: Exception, spider: Spider
     ) -> Union[Request, Response, None]:
+        if self.budget is not None:
+            self.budget.record_response(request)
+        if self.breakers is not None:
+            if isinstance(exception, self.exceptions_to_retry):
+                self.breakers.after_request(request, False, spider)
+            else:
+                # e.g. IgnoreRequest: not an outcome of the host or session.
+                self.breakers.release(request)
         if isinstance(exception, self.exceptions_to_retry) and not request.meta.get(
             "dont_retry", False
         ):
@@ -210,14 +598,23 @@ class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
         request: Request,
         reason: Union[str, Exception, Type[Exception]],
         spider: Spider,
+        response: Optional[Response] = None,
     ) -> Optional[Request]:
         max_retry_times = request.meta.get("max_retry_times", self.max_retry_times)
         priority_adjust = request.meta.get("priority_adjust", self.priority_adjust)
-        delay = int(request.meta.get('delay_request_by', 10) * 2)
 
-        spider.logger.info("Delaying request on URL %s by %d seconds", request.url, delay)
+        if self.budget is not None:
+            exhausted = self.budget.try_acquire(request)
+            if exhausted is not None:
+                spider.crawler.stats.inc_value(f"retry/budget_exhausted/{exhausted.split('/')[0]}")
+                spider.logger.error("Gave up retrying %s: retry budget exhausted for %s", request, exhausted)
+                return None
 
-        return get_retry_request(
+        delay = self.backoff.get_delay(request, response)
+
+        spider.logger.info("Delaying request on URL %s by %.1f seconds", request.url, delay)
+
+        new_request = get_retry_request(
             request,
             reason=reason,
             spider=spider,
@@ -225,5 +622,8 @@ class RetryMiddleware(metaclass=BackwardsCompatibilityMetaclass):
             priority_adjust=priority_adjust,
             delay=delay
         )
+        if new_request is not None and self.retry_at_end:
+            new_request.meta["retry_at_end"] = True
+        return new_request
 
     __getattr__ = backwards_compatibility_getattr
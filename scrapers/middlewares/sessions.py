@@ -0,0 +1,345 @@
+"""
+A downloader middleware which keeps a pool of warm sessions and leases them to requests on demand,
+instead of binding each session to a fixed part of the crawl.
+
+A session is a cookiejar, optionally bound to a proxy and to a Playwright context. It is warmed up
+by visiting SESSION_WARMUP_URL (the spider's start_url by default), which sets its cookies. Each
+time a request with the ``lease_session`` meta key is downloaded, it gets the ready session with
+the fewest requests in flight, so work flows to healthy sessions. If none is available, the request
+waits in the scheduler (see scrapers.scheduler.DelayedRequestScheduler) for a moment.
+
+You can change the behaviour of this middleware by modifying the scraping settings:
+SESSION_POOL_ENABLED - whether to enable it
+SESSION_POOL_SIZE - number of sessions to start with
+SESSION_POOL_MIN_SIZE, SESSION_POOL_MAX_SIZE - bounds of the pool size
+SESSION_POOL_INTERVAL - seconds between two resizes of the pool
+SESSION_MAX_IN_FLIGHT - maximum number of requests in flight per session
+SESSION_MAX_REQUESTS - number of requests after which a session is retired (0 for no limit)
+SESSION_BAN_HTTP_CODES - response codes which retire the session (403 by default)
+SESSION_MAX_RE_LEASES - number of times a request answered with a ban code is sent again with
+another session
+SESSION_THROTTLE_HTTP_CODES - response codes which pause the session (429 by default)
+SESSION_COOLDOWN - seconds during which a throttled session isn't leased
+SESSION_POOL_PROXIES - proxies bound to the new sessions in turn
+SESSION_POOL_PLAYWRIGHT - whether to give each session its own Playwright context
+SESSION_WARMUP_BACKOFF - seconds before replacing a session whose warmup failed, doubled at each
+consecutive failure (up to a minute)
+SESSION_WARMUP_MAX_FAILURES - number of consecutive failed warmups which close the spider
+
+The pool size follows the throughput: every SESSION_POOL_INTERVAL seconds, a session is added if
+requests had to wait for one and the throughput didn't drop since the last change, and removed if
+the last addition made the throughput drop or if sessions stayed idle.
+"""
+
+from __future__ import annotations
+
+import itertools
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Union
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.http.request import Request
+from scrapy.spiders import Spider
+from twisted.internet import reactor, task
+from twisted.python.failure import Failure
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+
+class Session:
+    __slots__ = ("id", "proxy", "ready", "retired", "requests", "in_flight", "cooldown_until")
+
+    def __init__(self, id: str, proxy: Optional[str] = None):
+        self.id = id
+        self.proxy = proxy
+        self.ready = False
+        self.retired = False
+        self.requests = 0
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"<Session {self.id}>"
+
+
+class SessionPoolMiddleware:
+    # Tolerance on the throughput before considering that a resize made it drop.
+    TOLERANCE = 0.05
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        if not settings.getbool("SESSION_POOL_ENABLED"):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_size = settings.getint("SESSION_POOL_MIN_SIZE", 1)
+        self.max_size = settings.getint("SESSION_POOL_MAX_SIZE", 32)
+        self.size = min(self.max_size, max(self.min_size, settings.getint("SESSION_POOL_SIZE", 9)))
+        self.interval = settings.getfloat("SESSION_POOL_INTERVAL", 10.0)
+        self.max_in_flight = settings.getint("SESSION_MAX_IN_FLIGHT", 4)
+        self.max_requests = settings.getint("SESSION_MAX_REQUESTS", 0)
+        self.ban_http_codes = set(int(x) for x in settings.getlist("SESSION_BAN_HTTP_CODES", [403]))
+        self.max_re_leases = settings.getint("SESSION_MAX_RE_LEASES", 3)
+        self.throttle_http_codes = set(int(x) for x in settings.getlist("SESSION_THROTTLE_HTTP_CODES", [429]))
+        self.cooldown = settings.getfloat("SESSION_COOLDOWN", 5.0)
+        self.warmup_url = settings.get("SESSION_WARMUP_URL")
+        self.playwright = settings.getbool("SESSION_POOL_PLAYWRIGHT")
+        self.proxies = itertools.cycle(settings.getlist("SESSION_POOL_PROXIES"))
+        self.warmup_backoff = settings.getfloat("SESSION_WARMUP_BACKOFF", 1.0)
+        self.warmup_max_failures = settings.getint("SESSION_WARMUP_MAX_FAILURES", 10)
+
+        self.sessions: Dict[str, Session] = {}
+        self._ids = itertools.count(1)
+        # Session of each lease (the ``session_lease`` meta key) not released yet.
+        self._leases: Dict[int, str] = {}
+        self._lease_ids = itertools.count(1)
+        self._task = None
+        self._warmup_failures = 0
+        self._fill_call = None
+
+        # Counters of the current resize interval.
+        self._responses = 0
+        self._waits = 0
+        self._requests_at_resize: Dict[str, int] = {}
+        self._last_rate: Optional[float] = None
+        self._last_change = 0
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> Self:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(o.request_left_downloader, signal=signals.request_left_downloader)
+        crawler.signals.connect(o.response_downloaded, signal=signals.response_downloaded)
+        return o
+
+    def spider_opened(self, spider: Spider) -> None:
+        self.spider = spider
+        self.warmup_url = self.warmup_url or spider.start_url
+        self._fill()
+
+        if self.interval > 0:
+            self._task = task.LoopingCall(self._resize)
+            self._task.start(self.interval, now=False)
+
+    def spider_closed(self, spider: Spider) -> None:
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        if self._fill_call is not None and self._fill_call.active():
+            self._fill_call.cancel()
+        self.stats.set_value("sessions/size", self.size)
+
+    def process_request(self, request: Request, spider: Spider) -> Optional[Request]:
+        if not request.meta.get("lease_session"):
+            return None
+
+        # Retried requests come back with the session of their previous attempt, and the requests sent
+        # back to the scheduler before the download (e.g. parked by the circuit breakers) with their lease.
+        self._release(request)
+        request.meta.pop("session_id", None)
+        session = self.lease()
+        if session is None:
+            # Wait in the scheduler until a session is ready or has room.
+            self._waits += 1
+            self.stats.inc_value("sessions/waited")
+            waiting = request.copy()
+            waiting.dont_filter = True
+            waiting.meta["delay_until"] = time.time() + random.uniform(0.5, 1.5)
+            return waiting
+
+        session.requests += 1
+        session.in_flight += 1
+        lease_id = next(self._lease_ids)
+        self._leases[lease_id] = session.id
+        request.meta["session_lease"] = lease_id
+        request.meta["session_id"] = session.id
+        request.meta["cookiejar"] = session.id
+        # The download slot and the circuit breakers follow the session.
+        request.meta.pop("download_slot", None)
+        request.meta.pop("circuit_probes", None)
+        self._bind(request, session)
+
+        if self.max_requests and session.requests >= self.max_requests:
+            self._retire(session, "max_requests")
+        return None
+
+    def process_response(self, request: Request, response: Response, spider: Spider) -> Union[Request, Response]:
+        # Also called for the responses which weren't downloaded, e.g. from the HTTP cache.
+        self._release(request)
+
+        # The session is retired (see response_downloaded): the request goes to another one.
+        re_leases = request.meta.get("session_re_leases", 0)
+        if (
+            request.meta.get("lease_session")
+            and response.status in self.ban_http_codes
+            and re_leases < self.max_re_leases
+        ):
+            self.stats.inc_value("sessions/re_leased")
+            new_request = request.copy()
+            new_request.dont_filter = True
+            new_request.meta["lease_session"] = True
+            new_request.meta["session_re_leases"] = re_leases + 1
+            for key in ("session_id", "cookiejar", "download_slot"):
+                new_request.meta.pop(key, None)
+            return new_request
+        return response
+
+    def process_exception(self, request: Request, exception: Exception, spider: Spider) -> None:
+        # e.g. IgnoreRequest from a later middleware.
+        self._release(request)
+        return None
+
+    def response_downloaded(self, response: Response, request: Request, spider: Spider) -> None:
+        session = self.sessions.get(request.meta.get("session_id"))
+        if session is None:
+            return
+
+        if response.status in self.ban_http_codes:
+            self._retire(session, "banned")
+        elif response.status in self.throttle_http_codes:
+            session.cooldown_until = time.time() + self.cooldown
+            self.stats.inc_value("sessions/throttled")
+        else:
+            self._responses += 1
+
+    def request_left_downloader(self, request: Request, spider: Spider) -> None:
+        self._release(request)
+
+    def _release(self, request: Request) -> None:
+        """Release the lease of a request, once: it comes back through several of these paths."""
+        session_id = self._leases.pop(request.meta.pop("session_lease", None), None)
+        if session_id is None:
+            return
+
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.in_flight = max(0, session.in_flight - 1)
+            if session.retired and not session.in_flight:
+                del self.sessions[session_id]
+
+    def lease(self) -> Optional[Session]:
+        """Return the ready session with the fewest requests in flight, or None if they are all busy."""
+        now = time.time()
+        best = None
+        for session in self.sessions.values():
+            if (
+                session.ready
+                and not session.retired
+                and session.cooldown_until <= now
+                and session.in_flight < self.max_in_flight
+                and (best is None or session.in_flight < best.in_flight)
+            ):
+                best = session
+        return best
+
+    def _bind(self, request: Request, session: Session) -> None:
+        if session.proxy:
+            request.meta["proxy"] = session.proxy
+        if self.playwright:
+            request.meta["playwright"] = True
+            request.meta["playwright_context"] = session.id
+
+    def _fill(self) -> None:
+        """Start new sessions until the pool has the target size."""
+        active = sum(1 for session in self.sessions.values() if not session.retired)
+        for _ in range(self.size - active):
+            session = Session(f"session{next(self._ids)}", next(self.proxies, None))
+            self.sessions[session.id] = session
+            self.stats.inc_value("sessions/created")
+
+            request = Request(
+                self.warmup_url,
+                callback=self._warmed_up,
+                errback=self._warmup_failed,
+                dont_filter=True,
+                priority=100,
+                meta=dict(cookiejar=session.id, session_id=session.id, session_warmup=True),
+            )
+            self._bind(request, session)
+            self.crawler.engine.crawl(request)
+
+    def _warmed_up(self, response: Response) -> None:
+        self._warmup_failures = 0
+        session = self.sessions.get(response.meta["session_id"])
+        if session is not None and not session.retired:
+            session.ready = True
+
+    def _warmup_failed(self, failure: Failure) -> None:
+        session = self.sessions.get(failure.request.meta["session_id"])
+        if session is None:
+            return
+
+        self.spider.logger.warning("Could not warm %s up: %s", session.id, failure.getErrorMessage())
+        self._retire(session, "warmup_failed", refill=False)
+        self._warmup_failures += 1
+        if self.warmup_max_failures and self._warmup_failures >= self.warmup_max_failures:
+            self.spider.logger.error("Giving up after %d failed session warmups", self._warmup_failures)
+            self.crawler.engine.close_spider(self.spider, "session_warmup_failed")
+            return
+
+        # The warmup URL may be down: don't hammer it with new sessions.
+        if self._fill_call is None or not self._fill_call.active():
+            delay = min(60.0, self.warmup_backoff * 2 ** (self._warmup_failures - 1))
+            self._fill_call = reactor.callLater(delay, self._fill)
+
+    def _retire(self, session: Session, reason: str, refill: bool = True) -> None:
+        if session.retired:
+            return
+
+        session.retired = True
+        self.stats.inc_value(f"sessions/retired/{reason}")
+        if not session.in_flight:
+            del self.sessions[session.id]
+        if refill:
+            self._fill()
+
+    def _resize(self) -> None:
+        """Add or remove a session depending on the demand and on the throughput of the last interval."""
+        rate = self._responses / self.interval
+        idle = [
+            session for session in self.sessions.values()
+            if session.ready and not session.retired
+            and session.requests == self._requests_at_resize.get(session.id, 0)
+        ]
+
+        change = 0
+        if self._last_rate is not None and self._last_change > 0 and rate < self._last_rate * (1 - self.TOLERANCE):
+            # The last session added made things worse.
+            change = -1
+        elif self._waits and not idle:
+            change = 1
+        elif not self._waits and idle:
+            change = -1
+
+        old_size = self.size
+        new_size = min(self.max_size, max(self.min_size, self.size + change))
+        if new_size < self.size:
+            victim = idle[0] if idle else min(
+                (s for s in self.sessions.values() if not s.retired), key=lambda s: s.in_flight, default=None
+            )
+            self.size = new_size
+            if victim is not None:
+                self._retire(victim, "shrink")
+        elif new_size > self.size:
+            self.size = new_size
+            self._fill()
+
+        self._last_change = new_size - old_size
+        self._last_rate = rate
+        self._responses = 0
+        self._waits = 0
+        self._requests_at_resize = {session.id: session.requests for session in self.sessions.values()}
+
+        self.stats.set_value("sessions/size", self.size)
+        self.stats.max_value("sessions/size_max", self.size)
+        self.spider.logger.info(
+            "Session pool: %d sessions, %d ready, %.1f responses/s",
+            self.size, sum(1 for s in self.sessions.values() if s.ready and not s.retired), rate,
+        )
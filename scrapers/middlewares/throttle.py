@@ -0,0 +1,156 @@
+"""
+A downloader middleware which adapts the concurrency of each session to what the target tolerates,
+with an AIMD (additive increase, multiplicative decrease) controller.
+
+Each session (cookiejar and proxy) gets its own download slot, whose concurrency is a window:
+- every successful response adds AIMD_INCREASE / window, so the window grows by about
+  AIMD_INCREASE per round trip,
+- a response with a code in AIMD_BACKOFF_HTTP_CODES (429, 503 by default) or a timeout
+  multiplies the window by AIMD_DECREASE, at most once per round trip.
+
+The window stays between AIMD_MIN_WINDOW and AIMD_MAX_WINDOW, and starts at AIMD_START_WINDOW.
+CONCURRENT_REQUESTS still caps the total: raise it to let the windows grow.
+
+The window of each session is exposed in the stats under aimd/window/<session>.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Union
+from urllib.parse import urlsplit
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.http.request import Request
+from scrapy.spiders import Spider
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.error import TCPTimedOutError, TimeoutError
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+
+def get_session_key(request: Request) -> str:
+    """Return the key of the session of the request: host, cookiejar and proxy."""
+    parts = [urlparse_cached(request).hostname or ""]
+
+    cookiejar = request.meta.get("cookiejar")
+    if cookiejar is not None:
+        parts.append(str(cookiejar))
+
+    proxy = request.meta.get("proxy")
+    if proxy:
+        # Without the credentials, which would end up in the stats.
+        parts.append(urlsplit(proxy).netloc.rpartition("@")[2])
+
+    return "|".join(parts)
+
+
+class Window:
+    __slots__ = ("size", "decreased_at")
+
+    def __init__(self, size: float):
+        self.size = size
+        self.decreased_at = 0.0
+
+
+class AdaptiveConcurrencyMiddleware:
+    EXCEPTIONS_TO_DECREASE = (TimeoutError, TCPTimedOutError)
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        if not settings.getbool("AIMD_ENABLED"):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_window = settings.getfloat("AIMD_START_WINDOW", 1.0)
+        self.min_window = settings.getfloat("AIMD_MIN_WINDOW", 1.0)
+        self.max_window = settings.getfloat("AIMD_MAX_WINDOW", 8.0)
+        self.increase = settings.getfloat("AIMD_INCREASE", 1.0)
+        self.decrease = settings.getfloat("AIMD_DECREASE", 0.5)
+        self.backoff_http_codes = set(
+            int(x) for x in settings.getlist("AIMD_BACKOFF_HTTP_CODES", [429, 503])
+        )
+
+        self.windows: Dict[str, Window] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> Self:
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider: Spider) -> None:
+        if self.windows:
+            self.stats.set_value(
+                "aimd/window_mean",
+                round(sum(w.size for w in self.windows.values()) / len(self.windows), 2),
+            )
+
+    def process_request(self, request: Request, spider: Spider) -> None:
+        key = request.meta.setdefault("download_slot", get_session_key(request))
+        request.meta["aimd_sent_at"] = time.monotonic()
+
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = Window(self.start_window)
+            self._update(key, window, request, spider)
+        else:
+            # The downloader drops the slots idle for a minute, and creates them again with the default concurrency.
+            self._apply(window, request)
+
+    def process_response(
+        self, request: Request, response: Response, spider: Spider
+    ) -> Union[Request, Response]:
+        key = request.meta.get("download_slot")
+        window = self.windows.get(key)
+        if window is None:
+            return response
+
+        if response.status in self.backoff_http_codes:
+            self._decrease(key, window, request, spider)
+        else:
+            window.size = min(self.max_window, window.size + self.increase / window.size)
+            self._update(key, window, request, spider)
+        return response
+
+    def process_exception(
+        self, request: Request, exception: Exception, spider: Spider
+    ) -> Optional[Response]:
+        key = request.meta.get("download_slot")
+        window = self.windows.get(key)
+        if window is not None and isinstance(exception, self.EXCEPTIONS_TO_DECREASE):
+            self._decrease(key, window, request, spider)
+        return None
+
+    def _decrease(self, key: str, window: Window, request: Request, spider: Spider) -> None:
+        # Requests sent before the last decrease belong to the same round trip: decrease only once.
+        if request.meta.get("aimd_sent_at", 0.0) < window.decreased_at:
+            return
+
+        window.size = max(self.min_window, window.size * self.decrease)
+        window.decreased_at = time.monotonic()
+        self.stats.inc_value("aimd/decrease_count")
+        self._update(key, window, request, spider)
+
+    def _update(self, key: str, window: Window, request: Request, spider: Spider) -> None:
+        """Apply the window to the download slot of the session and expose it in the stats."""
+        self._apply(window, request)
+        self.stats.set_value(f"aimd/window/{key}", round(window.size, 2))
+        self.stats.max_value("aimd/window_max", round(window.size, 2))
+
+    def _apply(self, window: Window, request: Request) -> None:
+        """Set the concurrency of the download slot of the request to the window, if the slot exists.
+
+        A new slot gets the default concurrency for its first request, as the downloader only creates it after
+        this middleware: the window applies from the next request on.
+        """
+        downloader = self.crawler.engine.downloader
+        slot = downloader.slots.get(downloader.get_slot_key(request))
+        if slot is not None:
+            slot.concurrency = max(1, int(window.size))
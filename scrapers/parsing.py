@@ -0,0 +1,124 @@
+"""
+A process pool extracting the hotel pages, so that parsing a large page doesn't stall the downloads.
+
+The HTML of a hotel page is parsed and extracted in the reactor thread, which blocks all the
+requests in flight for as long as it takes: tens of milliseconds for a hotel with thousands of
+reviews. With PARSE_POOL_ENABLED, the trekky spider sends the bodies of the pages larger than
+PARSE_POOL_MIN_SIZE bytes to a pool of processes, which run the same extraction (FAST_EXTRACTION or
+the item loaders) and send back a compact payload: the name, the email and the ratings as the bytes
+of a ReviewList array. The smaller pages are extracted inline, where the round trip to the pool
+would cost more than the parsing.
+
+The responses waiting for the pool still count in SCRAPER_SLOT_MAX_ACTIVE_SIZE, which stops the
+downloads when too many of them pile up. The extractions are reported in the stats:
+parse_pool/inline and parse_pool/offloaded count them, and parse_pool/ms is a histogram of the
+time the offloaded ones took, queueing included.
+
+You can change the behaviour of the pool by modifying the scraping settings:
+PARSE_POOL_ENABLED - whether to extract the large hotel pages in a process pool
+PARSE_POOL_WORKERS - number of processes (0 for the number of CPUs)
+PARSE_POOL_MIN_SIZE - size in bytes from which a page is extracted in the pool
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.spiders import Spider
+from twisted.internet.defer import Deferred
+
+from scrapers.extractors import extract_hotel, load_hotel
+from scrapers.items import HotelItem, ReviewList
+from scrapers.middlewares.info import record_duration
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+# Name, email and ratings (the bytes of the ReviewList array, None without reviews).
+HotelPayload = Tuple[Optional[str], Optional[str], Optional[bytes]]
+
+
+def extract_payload(url: str, body: bytes, encoding: str, fast: bool) -> HotelPayload:
+    """Extract a hotel page in a worker process, and return its payload."""
+    response = HtmlResponse(url, body=body, encoding=encoding)
+    item = extract_hotel(response.selector.root) if fast else load_hotel(response.selector)
+    return item_to_payload(item)
+
+
+def item_to_payload(item: HotelItem) -> HotelPayload:
+    reviews = item.reviews
+    return item.name, item.email, None if reviews is None else reviews.ratings.tobytes()
+
+
+def payload_to_item(payload: HotelPayload) -> HotelItem:
+    name, email, ratings = payload
+    reviews = None
+    if ratings is not None:
+        reviews = ReviewList()
+        reviews.ratings.frombytes(ratings)
+    return HotelItem(name=name, email=email, reviews=reviews)
+
+
+class ParserPool:
+    def __init__(self, crawler: Crawler, workers: int = 0, min_size: int = 65536):
+        # The spider creates the pool before the crawler creates its stats.
+        self.crawler = crawler
+        self.fast = crawler.settings.getbool("FAST_EXTRACTION")
+        self.workers = workers or os.cpu_count() or 1
+        self.min_size = min_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler) -> Self:
+        settings = crawler.settings
+        pool = cls(crawler, settings.getint("PARSE_POOL_WORKERS", 0), settings.getint("PARSE_POOL_MIN_SIZE", 65536))
+        crawler.signals.connect(pool.spider_closed, signal=signals.spider_closed)
+        return pool
+
+    def spider_closed(self, spider: Spider) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def offloads(self, response: TextResponse) -> bool:
+        """Whether the response is large enough to be extracted in the pool."""
+        return len(response.body) >= self.min_size
+
+    def extract(self, response: TextResponse) -> Deferred[HotelItem]:
+        """Extract the hotel of a response in the pool, the returned Deferred fires in the reactor thread."""
+        from twisted.internet import reactor
+
+        if self._executor is None:
+            # The reactor runs threads, which a forked child would inherit in an unknown state.
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        self.crawler.stats.inc_value("parse_pool/offloaded")
+        started = time.monotonic()
+        d: Deferred[HotelItem] = Deferred()
+
+        def done(future: Future[HotelPayload]) -> None:
+            # Called in a thread of the executor.
+            reactor.callFromThread(fire, future)
+
+        def fire(future: Future[HotelPayload]) -> None:
+            if future.cancelled():
+                d.cancel()
+                return
+            error = future.exception()
+            if error is not None:
+                d.errback(error)
+                return
+            record_duration(self.crawler.stats, "parse_pool/ms", (time.monotonic() - started) * 1000)
+            d.callback(payload_to_item(future.result()))
+
+        future = self._executor.submit(extract_payload, response.url, response.body, response.encoding, self.fast)
+        future.add_done_callback(done)
+        return d
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import logging
+from collections import deque
+from typing import Any, Callable, Deque
+
+from twisted.internet import threads
+from twisted.internet.defer import Deferred, succeed
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadPool:
+    """
+    A pool of payloads (e.g. the RSA-encrypted antibot payload) built ahead of demand.
+
+    Payloads are built by *build* in batches of *batch_size*, in the reactor's thread pool,
+    so that launching many sessions doesn't serialize on the encryption in the event loop.
+    The pool is refilled up to *size* payloads as soon as a batch is missing.
+
+    Call ``start()`` once the reactor is running, then ``get()`` returns a Deferred which
+    fires with a payload, right away if one is ready.
+    """
+
+    def __init__(self, build: Callable[[], Any], size: int = 50, batch_size: int = 10):
+        self.build = build
+        self.size = size
+        self.batch_size = max(1, min(batch_size, size))
+
+        self.hits = 0
+        self.misses = 0
+
+        self._payloads: Deque[Any] = deque()
+        self._waiters: Deque[Deferred] = deque()
+        self._refilling = False
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def start(self) -> None:
+        self._closed = False
+        self._refill()
+
+    def close(self) -> None:
+        self._closed = True
+        self._payloads.clear()
+
+    def get(self) -> Deferred:
+        if self._payloads:
+            self.hits += 1
+            d = succeed(self._payloads.popleft())
+        else:
+            self.misses += 1
+            d = Deferred()
+            self._waiters.append(d)
+
+        self._refill()
+        return d
+
+    def _refill(self) -> None:
+        if self._refilling or self._closed:
+            return
+
+        missing = self.size - len(self._payloads) + len(self._waiters)
+        if missing < self.batch_size and not self._waiters:
+            return
+
+        self._refilling = True
+        d = threads.deferToThread(self._build_batch, min(missing, self.batch_size) or 1)
+        d.addCallbacks(self._on_batch, self._on_error)
+
+    def _build_batch(self, count: int) -> list:
+        return [self.build() for _ in range(count)]
+
+    def _on_batch(self, payloads: list) -> None:
+        self._refilling = False
+        for payload in payloads:
+            if self._waiters:
+                self._waiters.popleft().callback(payload)
+            else:
+                self._payloads.append(payload)
+        self._refill()
+
+    def _on_error(self, failure: Failure) -> None:
+        self._refilling = False
+        logger.error("Failed to build payloads: %s", failure.getErrorMessage())
+
+        waiters, self._waiters = self._waiters, deque()
+        for waiter in waiters:
+            waiter.errback(failure)
@@ -0,0 +1,224 @@
+from collections import deque
+from scrapy import signals
+from twisted.internet import reactor, task, threads
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+import logging
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BufferedPipeline:
+    ###This base pipeline class writes the scraped data to disk through a bounded buffer.###
+    # Subclasses implement open_output(), write_items() and close_output(), and set settings_prefix.
+    # With streaming enabled, the buffer is flushed every <PREFIX>_FLUSH_ITEMS items
+    # or every <PREFIX>_FLUSH_INTERVAL seconds. Otherwise, everything is written when the spider is closed.
+    #
+    # With <PREFIX>_WRITER_THREAD enabled, serialization and disk I/O run on a dedicated writer thread.
+    # Items are handed over through a queue of <PREFIX>_WRITER_QUEUE_SIZE items. When the queue is full,
+    # process_item returns a Deferred which fires once the writer has caught up, so Scrapy stops feeding
+    # the pipeline until then. If the writer fails, the held items fail and the spider is closed.
+    settings_prefix = None
+    default_filename = None
+    default_streaming = True
+
+    # Longest time the writer thread waits for an item before checking the held items and the flush interval.
+    writer_poll_interval = 0.5
+
+    def __init__(self, filename=None, streaming=True, flush_items=1000, flush_interval=5.0,
+                 writer_thread=False, writer_queue_size=10000):
+        self.filename = filename or self.default_filename
+        self.streaming = streaming
+        self.flush_items = max(1, flush_items)
+        self.flush_interval = flush_interval
+        self.writer_thread = writer_thread
+        self.writer_queue_size = max(1, writer_queue_size)
+
+        self._items = []
+        self._last_flush = 0.0
+        self._flush_task = None
+
+        self._queue = None
+        self._thread = None
+        self._overflow = deque()
+        self._writer_failure = None
+        self.crawler = None
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(**cls.get_options(crawler.settings))
+        s.crawler = crawler
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    @classmethod
+    def get_options(cls, settings):
+        """Read the constructor arguments from the <PREFIX>_* settings."""
+        prefix = cls.settings_prefix
+        return dict(
+            filename=settings.get(f'{prefix}_FILE', cls.default_filename),
+            streaming=settings.getbool(f'{prefix}_STREAMING', cls.default_streaming),
+            flush_items=settings.getint(f'{prefix}_FLUSH_ITEMS', 1000),
+            flush_interval=settings.getfloat(f'{prefix}_FLUSH_INTERVAL', 5.0),
+            writer_thread=settings.getbool(f'{prefix}_WRITER_THREAD', False),
+            writer_queue_size=settings.getint(f'{prefix}_WRITER_QUEUE_SIZE', 10000),
+        )
+
+    def process_item(self, item, spider):
+        if self.writer_thread:
+            return self._enqueue(item)
+
+        self._items.append(item)
+
+        if self.streaming and (
+            len(self._items) >= self.flush_items
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+        return item
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self._items = []
+
+        if self.writer_thread:
+            self._queue = queue.Queue(maxsize=self.writer_queue_size)
+            self._thread = threading.Thread(target=self._run_writer, name=f'{self.__class__.__name__}-writer', daemon=True)
+            self._thread.start()
+            return
+
+        if self.streaming:
+            self.open_output()
+            self._last_flush = time.monotonic()
+
+            # Flush on a timer as well, so that rows don't stay in the buffer when items arrive slowly.
+            if self.flush_interval > 0:
+                self._flush_task = task.LoopingCall(self.flush)
+                self._flush_task.start(self.flush_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.writer_thread:
+            # Wait for the writer off the reactor thread: it still has to drain the queue.
+            self._overflow.append((_STOP, None))
+            self._drain_overflow()
+            return threads.deferToThread(self._thread.join)
+
+        if self.streaming:
+            if self._flush_task and self._flush_task.running:
+                self._flush_task.stop()
+        else:
+            self.open_output()
+
+        self.flush()
+        self.close_output()
+
+    def flush(self):
+        """Write the buffered items and empty the buffer."""
+        self._last_flush = time.monotonic()
+
+        if not self._items:
+            return
+
+        items, self._items = self._items, []
+        self.write_items(items)
+
+    def open_output(self):
+        raise NotImplementedError
+
+    def write_items(self, items):
+        raise NotImplementedError
+
+    def close_output(self):
+        raise NotImplementedError
+
+    def _enqueue(self, item):
+        if self._writer_failure is not None:
+            self._writer_failure.raiseException()
+
+        if not self._overflow:
+            try:
+                self._queue.put_nowait(item)
+                return item
+            except queue.Full:
+                pass
+
+        # The writer is behind: hold the item until it has room for it.
+        d = Deferred()
+        self._overflow.append((item, d))
+        # The writer may have made room since, and only drains the held items after taking one from the queue.
+        self._drain_overflow()
+        return d
+
+    def _drain_overflow(self):
+        """Move held items to the queue, in order, as long as there is room. Runs on the reactor thread."""
+        while self._overflow:
+            item, d = self._overflow[0]
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                return
+
+            self._overflow.popleft()
+            if d is not None:
+                d.callback(item)
+
+    def _run_writer(self):
+        try:
+            self._write()
+        except Exception:
+            logger.exception("Error in the writer thread of %s", self.filename)
+            reactor.callFromThread(self._writer_failed, Failure())
+
+    def _writer_failed(self, failure):
+        """Fail the held items and close the spider, as nothing writes them anymore. Runs on the reactor thread."""
+        self._writer_failure = failure
+        while self._overflow:
+            _, d = self._overflow.popleft()
+            if d is not None:
+                d.errback(failure)
+
+        if self.crawler is not None and self.crawler.engine is not None and self.spider is not None:
+            self.crawler.engine.close_spider(self.spider, 'pipeline_error')
+
+    def _write(self):
+        self.open_output()
+        self._last_flush = time.monotonic()
+        # Always wake up, so that items held in the overflow after the last check are drained.
+        timeout = self.writer_poll_interval
+        if self.streaming and self.flush_interval > 0:
+            timeout = min(timeout, self.flush_interval)
+
+        while True:
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if self._overflow:
+                reactor.callFromThread(self._drain_overflow)
+
+            if item is _STOP:
+                break
+
+            if item is not None:
+                self._items.append(item)
+
+            if self.streaming and (
+                len(self._items) >= self.flush_items
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                # A failed write ends the writer, which fails the held items and closes the spider.
+                self.flush()
+
+        self.flush()
+        self.close_output()
@@ -1,37 +1,38 @@
-from itemadapter import ItemAdapter
-from scrapy import signals
+from scrapers.items import item_to_dict
+from scrapers.pipelines.buffered import BufferedPipeline
 
 import csv
 
 
-class SaveToCsvPipeline:
+class SaveToCsvPipeline(BufferedPipeline):
     ###This pipeline class saves the scraped data to a CSV file named 'results.csv'.###
-    _items = []
-
-    @classmethod
-    def from_crawler(cls, crawler):
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
-        return s
-
-    def process_item(self, item, spider):
-        self._items.append(item)
-        return item
-
-    def spider_opened(self, spider):
-        self._items = []
-
-    def spider_closed(self, spider):
-        with open('results.csv', 'w', newline='') as csvfile:
-            csvwriter = csv.DictWriter(
-                csvfile,
-                fieldnames=['name', 'email', 'reviews'],
-                delimiter=',',
-                quotechar='"', quoting=csv.QUOTE_MINIMAL
-            )
-
-            csvwriter.writeheader()
-
-            for item in self._items:
-                csvwriter.writerow(ItemAdapter(item).asdict())
+    # By default, items are kept in memory and written when the spider is closed.
+    # With CSV_STREAMING enabled, rows are written while the spider runs through a bounded buffer,
+    # which is flushed every CSV_FLUSH_ITEMS items or every CSV_FLUSH_INTERVAL seconds.
+    settings_prefix = 'CSV'
+    default_filename = 'results.csv'
+    default_streaming = False
+
+    fieldnames = ['name', 'email', 'reviews']
+
+    def open_output(self):
+        self._file = open(self.filename, 'w', newline='')
+        self._writer = csv.DictWriter(
+            self._file,
+            fieldnames=self.fieldnames,
+            delimiter=',',
+            quotechar='"', quoting=csv.QUOTE_MINIMAL
+        )
+
+        self._writer.writeheader()
+        self._file.flush()
+
+    def write_items(self, items):
+        for item in items:
+            self._writer.writerow(item_to_dict(item))
+
+        self._file.flush()
+
+    def close_output(self):
+        self._file.close()
+        self._file = None
@@ -0,0 +1,37 @@
+from scrapers.items import item_to_dict
+from scrapers.pipelines.buffered import BufferedPipeline
+
+import gzip
+import json
+
+
+class SaveToJsonLinesPipeline(BufferedPipeline):
+    ###This pipeline class saves the scraped data to a gzipped JSON Lines file named 'results.jsonl.gz'.###
+    # Reviews are kept as a JSON array of objects, so they can be loaded without any re-parsing.
+    # Every flush ends a deflate block, which keeps the file readable if the crawl is interrupted.
+    settings_prefix = 'JSONL'
+    default_filename = 'results.jsonl.gz'
+
+    def __init__(self, compresslevel=6, **kwargs):
+        super().__init__(**kwargs)
+        self.compresslevel = compresslevel
+
+    @classmethod
+    def get_options(cls, settings):
+        options = super().get_options(settings)
+        options['compresslevel'] = settings.getint('JSONL_COMPRESSLEVEL', 6)
+        return options
+
+    def open_output(self):
+        self._file = gzip.open(self.filename, 'wt', encoding='utf-8', compresslevel=self.compresslevel)
+
+    def write_items(self, items):
+        self._file.writelines(
+            json.dumps(item_to_dict(item), ensure_ascii=False, separators=(',', ':')) + '\n'
+            for item in items
+        )
+        self._file.flush()
+
+    def close_output(self):
+        self._file.close()
+        self._file = None
@@ -0,0 +1,75 @@
+from itemadapter import ItemAdapter
+from scrapers.items import ReviewList
+from scrapers.pipelines.buffered import BufferedPipeline
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class SaveToParquetPipeline(BufferedPipeline):
+    ###This pipeline class saves the scraped data to two Parquet files: 'hotels.parquet' and 'reviews.parquet'.###
+    # Reviews are flattened into their own table, joined to hotels on hotel_id, with a float32 rating column.
+    # Every flush is written as a row group.
+    settings_prefix = 'PARQUET'
+    default_filename = 'hotels.parquet'
+
+    hotels_schema = pa.schema([
+        ('hotel_id', pa.int64()),
+        ('name', pa.string()),
+        ('email', pa.string()),
+        ('reviews_count', pa.int32()),
+    ])
+
+    reviews_schema = pa.schema([
+        ('hotel_id', pa.int64()),
+        ('rating', pa.float32()),
+    ])
+
+    def __init__(self, reviews_filename='reviews.parquet', compression='zstd', **kwargs):
+        super().__init__(**kwargs)
+        self.reviews_filename = reviews_filename
+        self.compression = compression
+        self._next_hotel_id = 0
+
+    @classmethod
+    def get_options(cls, settings):
+        options = super().get_options(settings)
+        options['reviews_filename'] = settings.get('PARQUET_REVIEWS_FILE', 'reviews.parquet')
+        options['compression'] = settings.get('PARQUET_COMPRESSION', 'zstd')
+        return options
+
+    def open_output(self):
+        self._next_hotel_id = 0
+        self._hotels_writer = pq.ParquetWriter(self.filename, self.hotels_schema, compression=self.compression)
+        self._reviews_writer = pq.ParquetWriter(self.reviews_filename, self.reviews_schema, compression=self.compression)
+
+    def write_items(self, items):
+        hotels = {name: [] for name in self.hotels_schema.names}
+        reviews = {name: [] for name in self.reviews_schema.names}
+
+        for item in items:
+            adapter = ItemAdapter(item)
+            hotel_id = self._next_hotel_id
+            self._next_hotel_id += 1
+
+            reviews_list = adapter.get('reviews') or []
+            if isinstance(reviews_list, ReviewList):
+                ratings = reviews_list.values()
+            else:
+                ratings = [ItemAdapter(review).get('rating') for review in reviews_list]
+
+            hotels['hotel_id'].append(hotel_id)
+            hotels['name'].append(adapter.get('name'))
+            hotels['email'].append(adapter.get('email'))
+            hotels['reviews_count'].append(len(ratings))
+
+            reviews['hotel_id'].extend([hotel_id] * len(ratings))
+            reviews['rating'].extend(ratings)
+
+        self._hotels_writer.write_table(pa.Table.from_pydict(hotels, schema=self.hotels_schema))
+        if reviews['hotel_id']:
+            self._reviews_writer.write_table(pa.Table.from_pydict(reviews, schema=self.reviews_schema))
+
+    def close_output(self):
+        self._hotels_writer.close()
+        self._reviews_writer.close()
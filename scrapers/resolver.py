@@ -0,0 +1,100 @@
+"""
+A DNS resolver which caches the lookups for DNS_TTL seconds, to set as DNS_RESOLVER.
+
+Scrapy's resolver caches the lookups for the whole process. This one expires them after DNS_TTL
+seconds, and refreshes an entry in the background when it is used during the last quarter of its
+TTL, so the hosts in use are never looked up while a request waits, and the requests waiting for
+the same name share its lookup. The target and proxy hosts are looked up as soon as the spider
+opens (see scrapers.handlers.SessionDownloadHandler).
+
+The lookups are reported in the stats: dns/cache_hits and dns/lookups count them, and
+dns/lookup_ms is a histogram of their duration.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from scrapy.resolver import CachingThreadedResolver
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.datatypes import LocalCache
+from twisted.internet import defer
+from twisted.internet.base import ReactorBase, ThreadedResolver
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IResolverSimple
+from twisted.python.failure import Failure
+from zope.interface.declarations import implementer
+
+from scrapers.middlewares.info import record_duration
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+
+@implementer(IResolverSimple)
+class TTLCachingResolver(CachingThreadedResolver):
+    def __init__(self, reactor: ReactorBase, cache_size: int, timeout: float, ttl: float):
+        super().__init__(reactor, cache_size, timeout)
+        self.ttl = ttl
+        # The resolver is installed by the crawler process, before the stats exist: they are set by
+        # the download handler.
+        self.stats: Optional[StatsCollector] = None
+        self.cache: LocalCache[str, Tuple[str, float]] = LocalCache(cache_size)
+        # Requests waiting for a lookup in progress, by name.
+        self._waiters: Dict[str, List[Deferred[str]]] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Any, reactor: ReactorBase) -> Self:
+        settings = crawler.settings
+        cache_size = settings.getint("DNSCACHE_SIZE") if settings.getbool("DNSCACHE_ENABLED") else 0
+        return cls(reactor, cache_size, settings.getfloat("DNS_TIMEOUT"), settings.getfloat("DNS_TTL", 300.0))
+
+    def getHostByName(self, name: str, timeout: Sequence[int] = ()) -> Deferred[str]:
+        entry = self.cache.get(name)
+        if entry is not None:
+            address, expires = entry
+            remaining = expires - time.monotonic()
+            if remaining > 0:
+                self._inc("dns/cache_hits")
+                if remaining < self.ttl / 4 and name not in self._waiters:
+                    self.lookup(name).addErrback(lambda failure: None)
+                return defer.succeed(address)
+        return self.lookup(name)
+
+    def lookup(self, name: str) -> Deferred[str]:
+        """Look the name up, bypassing the cache, and cache the result."""
+        waiters = self._waiters.get(name)
+        if waiters is not None:
+            d: Deferred[str] = Deferred()
+            waiters.append(d)
+            return d
+
+        self._waiters[name] = []
+        started = time.monotonic()
+        # The timeout is passed as a sequence but supports floats.
+        d = ThreadedResolver.getHostByName(self, name, (self.timeout,))  # type: ignore[arg-type]
+        d.addBoth(self._looked_up, name, started)
+        return d
+
+    def _looked_up(self, result: Union[str, Failure], name: str, started: float) -> Union[str, Failure]:
+        # A failed lookup isn't cached: an entry being refreshed expires, and is looked up again.
+        if not isinstance(result, Failure):
+            now = time.monotonic()
+            if self.cache.limit:
+                self.cache[name] = (result, now + self.ttl)
+            self._inc("dns/lookups")
+            if self.stats is not None:
+                record_duration(self.stats, "dns/lookup_ms", (now - started) * 1000)
+
+        for waiter in self._waiters.pop(name):
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+        return result
+
+    def _inc(self, key: str) -> None:
+        if self.stats is not None:
+            self.stats.inc_value(key)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.http.request import Request
+from scrapy.pqueues import DownloaderAwarePriorityQueue
+from scrapy.squeues import PickleFifoDiskQueue
+from scrapy.utils.job import job_dir
+from twisted.internet import reactor
+
+from scrapers.middlewares.throttle import get_session_key
+
+if TYPE_CHECKING:
+    # typing.Self requires Python 3.11
+    from typing_extensions import Self
+
+
+class DelayedRequestScheduler(Scheduler):
+    """
+    A scheduler which holds delayed requests (the ``delay_until`` meta key, a UNIX timestamp)
+    outside of the downloader until they are due.
+
+    Delayed requests are kept in a heap ordered by due time. They are handed out before the
+    regular requests once due, and the engine is woken up at that time. Unlike a sleep in a
+    downloader middleware, a waiting request doesn't occupy one of the ``CONCURRENT_REQUESTS``
+    slots, so healthy requests keep the full concurrency while failed ones back off.
+
+    Delayed requests are kept in memory only: they are lost if the crawl is paused with a JOBDIR.
+
+    Requests with the ``retry_at_end`` meta key (see ``RETRY_AT_END``) are parked in a queue on
+    disk instead, so that a large outage doesn't fill the memory with failed requests. They are
+    replayed once the frontier is drained: no regular or delayed request is left, and nothing is
+    in progress. The queue lives in the JOBDIR if there is one, and in a temporary directory
+    otherwise. On replay, the requests can be moved to another session with
+    ``RETRY_AT_END_COOKIEJARS`` and ``RETRY_AT_END_PROXIES``, which are cycled through.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._delayed: list[tuple[float, int, Request]] = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._wakeup_at: Optional[float] = None
+
+        self._at_end = None
+        self._at_end_dir: Optional[str] = None
+        self._at_end_tempdir = False
+        self._replaying = False
+
+        settings = self.crawler.settings
+        self._cookiejars = itertools.cycle(settings.getlist("RETRY_AT_END_COOKIEJARS"))
+        self._proxies = itertools.cycle(settings.getlist("RETRY_AT_END_PROXIES"))
+
+    def open(self, spider):
+        result = super().open(spider)
+
+        jobdir = job_dir(self.crawler.settings)
+        if jobdir:
+            self._at_end_dir = str(Path(jobdir, "retry.queue"))
+        else:
+            self._at_end_dir = tempfile.mkdtemp(prefix="scrapy-retry-")
+            self._at_end_tempdir = True
+        self._at_end = PickleFifoDiskQueue.from_crawler(self.crawler, str(Path(self._at_end_dir, "q")))
+        if len(self._at_end):
+            spider.logger.info("Resuming with %d requests to retry at the end", len(self._at_end))
+        return result
+
+    def close(self, reason: str):
+        if self._wakeup is not None and self._wakeup.active():
+            self._wakeup.cancel()
+        if self._delayed:
+            self.spider.logger.warning("Dropping %d delayed requests", len(self._delayed))
+
+        if self._at_end is not None:
+            pending = len(self._at_end)
+            self._at_end.close()
+            if self._at_end_tempdir:
+                if pending:
+                    self.spider.logger.warning("Dropping %d requests to retry at the end", pending)
+                shutil.rmtree(self._at_end_dir, ignore_errors=True)
+        return super().close(reason)
+
+    def enqueue_request(self, request: Request) -> bool:
+        if request.meta.get("retry_at_end") and self._at_end is not None:
+            if self._push_at_end(request):
+                return True
+
+        due = request.meta.get("delay_until")
+        if not due or due <= time.time():
+            return super().enqueue_request(request)
+
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+
+        heapq.heappush(self._delayed, (due, next(self._counter), request))
+        self.stats.inc_value("scheduler/enqueued/delayed", spider=self.spider)
+        self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        self._schedule_wakeup()
+        return True
+
+    def next_request(self) -> Optional[Request]:
+        if self._delayed and self._delayed[0][0] <= time.time():
+            _, _, request = heapq.heappop(self._delayed)
+            self._schedule_wakeup()
+            self.stats.inc_value("scheduler/dequeued/delayed", spider=self.spider)
+            self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+            return request
+
+        request = super().next_request()
+        if request is None and self._at_end is not None and len(self._at_end):
+            request = self._pop_at_end()
+        return request
+
+    def __len__(self) -> int:
+        return super().__len__() + len(self._delayed) + (len(self._at_end) if self._at_end is not None else 0)
+
+    def _push_at_end(self, request: Request) -> bool:
+        try:
+            self._at_end.push(request)
+        except ValueError:
+            # Not serializable, e.g. a callback which isn't a spider method: keep the usual delay.
+            self.stats.inc_value("scheduler/unserializable/retry_at_end", spider=self.spider)
+            return False
+
+        self.stats.inc_value("scheduler/enqueued/retry_at_end", spider=self.spider)
+        self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        return True
+
+    def _pop_at_end(self) -> Optional[Request]:
+        """Replay a request parked until the end, once the frontier is drained."""
+        if not self._replaying:
+            engine = self.crawler.engine
+            slot = getattr(engine, "_slot", None)
+            if self._delayed or (slot is not None and slot.inprogress) or getattr(engine, "_start", None):
+                return None
+
+            self._replaying = True
+            self.spider.logger.info("Frontier drained, retrying %d failed requests", len(self._at_end))
+
+        request = self._at_end.pop()
+        # Requests built from its response, which often reuse its meta, are regular requests again.
+        del request.meta["retry_at_end"]
+        if not len(self._at_end):
+            self._replaying = False
+
+        self.stats.inc_value("scheduler/dequeued/retry_at_end", spider=self.spider)
+        self._switch_session(request)
+
+        due = request.meta.get("delay_until")
+        if due and due > time.time():
+            # Still backing off: wait in the heap, without going through the dupefilter again.
+            heapq.heappush(self._delayed, (due, next(self._counter), request))
+            self._schedule_wakeup()
+            return None
+
+        self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+        return request
+
+    def _switch_session(self, request: Request) -> None:
+        cookiejar = next(self._cookiejars, None)
+        proxy = next(self._proxies, None)
+        if cookiejar is None and proxy is None:
+            return
+
+        if cookiejar is not None:
+            request.meta["cookiejar"] = cookiejar
+        if proxy is not None:
+            request.meta["proxy"] = proxy
+        # The download slot and the circuit breakers follow the new session.
+        request.meta.pop("download_slot", None)
+        request.meta.pop("circuit_probes", None)
+
+    def _schedule_wakeup(self):
+        """Wake the engine up when the next delayed request is due, instead of waiting for its heartbeat."""
+        if not self._delayed:
+            return
+
+        due = self._delayed[0][0]
+        if due <= time.time():
+            # Already due: the engine picks it up as soon as a download slot is free.
+            return
+
+        if self._wakeup is not None and self._wakeup.active():
+            if self._wakeup_at <= due:
+                return
+            self._wakeup.cancel()
+
+        self._wakeup_at = due
+        self._wakeup = reactor.callLater(max(0.0, due - time.time()), self._wake)
+
+    def _wake(self):
+        self._wakeup = None
+
+        engine = self.crawler.engine
+        slot = getattr(engine, "_slot", None)
+        if slot is not None:
+            slot.nextcall.schedule()
+
+        self._schedule_wakeup()
+
+
+class SessionPriorityQueue(DownloaderAwarePriorityQueue):
+    """
+    A priority queue (to set as ``SCHEDULER_PRIORITY_QUEUE``) with one queue per session (host,
+    cookiejar and proxy, see scrapers.middlewares.throttle.get_session_key), which hands out the
+    request of highest priority among the sessions under their quota.
+
+    A session gets at most ``SCHEDULER_SESSION_QUOTA`` requests in progress (0 for no quota), so a
+    session with many pages queued doesn't fill the downloader while the others wait, and the
+    requests of a session beyond its concurrency stay in the scheduler rather than in a download
+    slot. When every session with queued requests is at its quota, nothing is handed out until a
+    request finishes. With the priorities set by the spider, which favor the hotel pages over the
+    pages starting a new session, the sessions are crawled depth first.
+
+    The requests are counted under the session they are queued with. With SESSION_POOL_ENABLED, the
+    session is only leased once the request is downloaded (see scrapers.middlewares.sessions), so
+    a request queued without a cookiejar counts under its host: the quota then bounds the requests
+    in progress per host, and SESSION_MAX_IN_FLIGHT the requests per session of the pool.
+
+    The size of the queue is reported in the stats: scheduler/pending/max and
+    scheduler/sessions/max are the largest number of requests and sessions queued.
+    """
+
+    def __init__(self, crawler, *args, **kwargs):
+        super().__init__(crawler, *args, **kwargs)
+        self.quota = crawler.settings.getint("SCHEDULER_SESSION_QUOTA", 0)
+        self._len = sum(len(queue) for queue in self.pqueues.values())
+
+    def push(self, request: Request) -> None:
+        key = request.meta["scheduler_session"] = get_session_key(request)
+        queue = self.pqueues.get(key)
+        if queue is None:
+            queue = self.pqueues[key] = self.pqfactory(key)
+        queue.push(request)
+
+        self._len += 1
+        stats = self.crawler.stats
+        stats.max_value("scheduler/pending/max", self._len)
+        stats.max_value("scheduler/sessions/max", len(self.pqueues))
+
+    def pop(self) -> Optional[Request]:
+        key = self._next_session()
+        if key is None:
+            return None
+
+        queue = self.pqueues[key]
+        request = queue.pop()
+        if len(queue) == 0:
+            del self.pqueues[key]
+        if request is not None:
+            self._len -= 1
+        return request
+
+    def peek(self) -> Optional[Request]:
+        key = self._next_session()
+        return None if key is None else self.pqueues[key].peek()
+
+    def close(self) -> dict[str, list[int]]:
+        self._len = 0
+        return super().close()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _next_session(self) -> Optional[str]:
+        """Return the session of the request to hand out: highest priority first, then fewest requests in progress."""
+        in_progress = self._in_progress() if self.quota else Counter()
+        best, best_rank = None, None
+        for key, queue in self.pqueues.items():
+            count = in_progress[key]
+            if queue.curprio is None or (self.quota and count >= self.quota):
+                continue
+            # curprio is the opposite of the priority of the first request of the queue.
+            rank = (queue.curprio, count)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = key, rank
+        return best
+
+    def _in_progress(self) -> Counter[str]:
+        """Count the requests in progress per session, from the engine, as the downloader slots may be per host.
+
+        A request counts under the session it was queued with, which a leased session replaces afterwards.
+        """
+        slot = getattr(self.crawler.engine, "_slot", None)
+        if slot is None:
+            return Counter()
+        return Counter(
+            request.meta.get("scheduler_session") or get_session_key(request) for request in slot.inprogress
+        )
@@ -8,15 +8,143 @@ DOWNLOAD_TIMEOUT = 10
 
 SPIDER_MIDDLEWARES = {
     'scrapers.middlewares.info.InfoSpiderMiddleware': 40,
+    # After HttpErrorMiddleware (50), so the error pages never reach the index.
+    'scrapers.middlewares.index.HotelIndexSpiderMiddleware': 55,
 }
 
 ITEM_PIPELINES = {
     'scrapers.pipelines.csv.SaveToCsvPipeline': 300,
+    # Alternative outputs with structured reviews:
+    # 'scrapers.pipelines.jsonl.SaveToJsonLinesPipeline': 310,
+    # 'scrapers.pipelines.parquet.SaveToParquetPipeline': 320,
 }
 
+# Log the throughput and requests in flight every INFO_INTERVAL seconds.
+INFO_INTERVAL = 60.0
+
+# Failures are aggregated by error and URL pattern and reported every FAILURE_REPORT_INTERVAL seconds,
+# with FAILURE_SAMPLES sampled responses per group in the final report.
+FAILURE_REPORT_INTERVAL = 60.0
+FAILURE_SAMPLES = 3
+
+# Hold delayed retries in the scheduler instead of a download slot.
+SCHEDULER = "scrapers.scheduler.DelayedRequestScheduler"
+
+# Exponential backoff of retried requests, see scrapers/middlewares/retry.py.
+RETRY_BACKOFF_BASE = 20.0
+RETRY_BACKOFF_MULTIPLIER = 2.0
+RETRY_BACKOFF_MAX = 300.0
+RETRY_BACKOFF_JITTER = "full"
+
+# Maximum ratio of retries to responses, per cookiejar and per domain (0 disables the budget).
+RETRY_BUDGET_RATIO = 0.0
+RETRY_BUDGET_MIN = 10
+
+# Retry failed pages once all the other pages are crawled, from a queue on disk.
+RETRY_AT_END = False
+RETRY_AT_END_COOKIEJARS = []
+RETRY_AT_END_PROXIES = []
+
+# Park the requests of a failing host or session instead of retrying them, see scrapers/middlewares/retry.py.
+CIRCUIT_BREAKER_ENABLED = False
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+CIRCUIT_BREAKER_OPEN_SECONDS = 60.0
+
+# Maximum number of listing pages requested at the same time, the pages being discovered as the crawl goes.
+LISTING_CONCURRENCY = 4
+
+# Crawl the sessions depth first: the hotel pages go before the pages starting a new session, each session gets at
+# most SCHEDULER_SESSION_QUOTA requests in progress, and the listing pages are held back while more than
+# LISTING_MAX_BACKLOG requests are scheduled (0 for no limit), see scrapers.scheduler.SessionPriorityQueue.
+# With SESSION_POOL_ENABLED, the sessions are leased at download time: the requests queued without a cookiejar count
+# under their host, so the quota applies per host, and SESSION_MAX_IN_FLIGHT per session.
+HOTEL_PRIORITY = 10
+SCHEDULER_PRIORITY_QUEUE = "scrapers.scheduler.SessionPriorityQueue"
+SCHEDULER_SESSION_QUOTA = 0
+LISTING_MAX_BACKLOG = 0
+
+# Lease the sessions of a pool to the requests instead of binding one session to each listing page,
+# see scrapers/middlewares/sessions.py.
+SESSION_POOL_ENABLED = False
+SESSION_POOL_SIZE = 9
+SESSION_POOL_MAX_SIZE = 32
+SESSION_MAX_IN_FLIGHT = 4
+SESSION_MAX_REQUESTS = 0
+SESSION_MAX_RE_LEASES = 3
+
+# Adapt the concurrency of each session (cookiejar and proxy) to the 429s it gets.
+# CONCURRENT_REQUESTS caps the total: raise it when enabling this.
+AIMD_ENABLED = False
+AIMD_START_WINDOW = 1.0
+AIMD_MIN_WINDOW = 1.0
+AIMD_MAX_WINDOW = 8.0
+
+# Only follow the hotels which are new or changed on the listing pages since the last crawl,
+# with a full crawl every INCREMENTAL_FULL_REFRESH_DAYS days, see scrapers/incremental.py.
+INCREMENTAL_ENABLED = False
+INCREMENTAL_PATH = "incremental.db"
+INCREMENTAL_FULL_REFRESH_DAYS = 7
+
+# Set the connections up per session (cookiejar and proxy): keep them alive, or resume the TLS sessions
+# when they are closed after each request, see scrapers/handlers.py.
+DOWNLOAD_HANDLERS = {
+    "http": "scrapers.handlers.SessionDownloadHandler",
+    "https": "scrapers.handlers.SessionDownloadHandler",
+}
+KEEPALIVE_ENABLED = False
+KEEPALIVE_IDLE_TIMEOUT = 30.0
+KEEPALIVE_MAX_REQUESTS = 100
+KEEPALIVE_MAX_SESSIONS = 1000
+TLS_SESSION_RESUMPTION = False
+
+# Cache the DNS lookups for DNS_TTL seconds and look the target and proxy hosts up when the spider opens,
+# see scrapers/resolver.py.
+DNS_RESOLVER = "scrapers.resolver.TTLCachingResolver"
+DNS_TTL = 300.0
+DNS_PRERESOLVE = True
+DNS_PRERESOLVE_HOSTS = []
+
+# Run the spider in several processes sharing a frontier with python -m scrapers.distributed,
+# with at most RATE_LIMIT requests per second per host across all of them, see scrapers/distributed.py.
+DISTRIBUTED_ENABLED = False
+DISTRIBUTED_BATCH_SIZE = 1
+DISTRIBUTED_POLL_INTERVAL = 0.2
+RATE_LIMIT = 0.0
+RATE_LIMIT_BURST = 5
+
+# Cache the hotel pages on disk, keyed by the request fingerprint, and revalidate them on every crawl,
+# see scrapers/httpcache.py.
+HTTPCACHE_ENABLED = False
+HTTPCACHE_POLICY = "scrapers.httpcache.HotelPagesPolicy"
+HTTPCACHE_STORAGE = "scrapers.httpcache.EvictingFilesystemCacheStorage"
+HTTPCACHE_GZIP = True
+HTTPCACHE_MAX_AGE = 30 * 24 * 3600
+HTTPCACHE_MAX_SIZE_MB = 512
+
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 
 # Prevent Scrapy from overriding Chrome's default HTTP headers.
 PLAYWRIGHT_PROCESS_REQUEST_HEADERS=None
+
+# Write results.csv while crawling instead of keeping every item in memory until the end.
+CSV_STREAMING = True
+CSV_FLUSH_ITEMS = 1000
+CSV_FLUSH_INTERVAL = 5.0
+
+# Serialize and write items on a dedicated thread instead of the reactor thread.
+CSV_WRITER_THREAD = False
+CSV_WRITER_QUEUE_SIZE = 10000
+
+# Skip hotels already extracted by previous runs.
+HOTEL_INDEX_ENABLED = False
+HOTEL_INDEX_PATH = "hotels.idx"
+
+# Extract hotels with precompiled XPath queries instead of item loaders.
+FAST_EXTRACTION = True
+
+# Extract the hotel pages of at least PARSE_POOL_MIN_SIZE bytes in a process pool, see scrapers/parsing.py.
+PARSE_POOL_ENABLED = False
+PARSE_POOL_WORKERS = 0
+PARSE_POOL_MIN_SIZE = 65536
@@ -1,6 +1,13 @@
-from scrapy import Request, Spider
-from scrapers.items import HotelItemLoader, ReviewItemLoader
-from scrapers.utils import print_failure
+from collections import deque
+from scrapy import Request, Spider, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapers.extractors import extract_hotel, load_hotel, load_review
+from scrapers.incremental import ListingDigests
+from scrapers.middlewares.info import instrumented
+from scrapers.parsing import ParserPool
+from scrapers.utils import FailureAggregator
+from urllib.parse import parse_qs, urlencode, urljoin, urlsplit
 
 
 class TrekkySpider(Spider):
@@ -23,59 +30,246 @@ class TrekkySpider(Spider):
 
         "DOWNLOADER_MIDDLEWARES": {
             'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+            'scrapers.middlewares.ratelimit.GlobalRateLimitMiddleware': 520,
+            'scrapers.middlewares.sessions.SessionPoolMiddleware': 530,
             'scrapers.middlewares.retry.RetryMiddleware': 550,
+            'scrapers.middlewares.throttle.AdaptiveConcurrencyMiddleware': 560,
         },
     }
 
+    # Comma-separated list of the cities to crawl, e.g. scrapy crawl trekky -a cities=paris,lyon
+    cities = "paris"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if isinstance(self.cities, str):
+            self.cities = [city.strip() for city in self.cities.split(",") if city.strip()]
+
+        # Highest listing page scheduled per city, listing pages waiting to be requested and in flight.
+        self.known_pages = {}
+        self.pending_listings = deque()
+        self.listings_in_flight = 0
+        # Listing pages held back by LISTING_MAX_BACKLOG, counted once each.
+        self.held_back = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.failures = FailureAggregator.from_crawler(crawler, spider.logger)
+        spider.digests = None
+        if crawler.settings.getbool("INCREMENTAL_ENABLED"):
+            # scrapy crawl trekky -a full=1 follows every hotel, see scrapers/incremental.py
+            spider.digests = ListingDigests.from_crawler(crawler, force_full=bool(kwargs.get("full")))
+        spider.parser_pool = None
+        if crawler.settings.getbool("PARSE_POOL_ENABLED"):
+            spider.parser_pool = ParserPool.from_crawler(crawler)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
     def start_requests(self):
-        """This method start 10 separate sessions on the homepage, one per page."""
-        for page in range(1, 10):
-            yield Request(
-                url=self.start_url,
-                callback=self.parse,
-                errback=self.errback,
-                dont_filter=True,
-                meta=dict(
-                    page=page,
-                    cookiejar="jar%d" % page,
-                ),
+        """This method starts with the first listing page of each city, the other pages are discovered from it.
+
+        At most LISTING_CONCURRENCY listing pages are requested at the same time.
+        """
+        for city in self.cities:
+            self.known_pages[city] = 1
+            self.pending_listings.append((city, 1))
+
+        yield from self.next_listings()
+
+    def next_listings(self):
+        """Request the pending listing pages, up to LISTING_CONCURRENCY in flight.
+
+        While more than LISTING_MAX_BACKLOG requests are scheduled, the listing pages are held back until the hotel
+        pages are crawled (see resume_listings).
+
+        In distributed mode, the listing pages are parsed by other workers: they all go to the shared frontier
+        right away, and RATE_LIMIT paces them (see scrapers/distributed.py).
+        """
+        limit = self.settings.getint("LISTING_CONCURRENCY", 4)
+        distributed = self.settings.getbool("DISTRIBUTED_ENABLED")
+        while self.pending_listings and (distributed or self.listings_in_flight < limit):
+            if not distributed and self.backlogged():
+                if self.pending_listings[0] not in self.held_back:
+                    self.held_back.add(self.pending_listings[0])
+                    self.crawler.stats.inc_value("listing/held_back")
+                return
+            city, page = self.pending_listings.popleft()
+            self.held_back.discard((city, page))
+            self.listings_in_flight += 1
+            yield self.listing_request(city, page)
+
+    def backlogged(self):
+        """Return whether more than LISTING_MAX_BACKLOG requests are scheduled (never with 0).
+
+        The listing pages in flight count in the backlog, as the requests they lead to aren't scheduled yet.
+        """
+        max_backlog = self.settings.getint("LISTING_MAX_BACKLOG", 0)
+        slot = getattr(self.crawler.engine, "_slot", None)
+        return bool(max_backlog) and slot is not None and len(slot.scheduler) + self.listings_in_flight > max_backlog
+
+    def resume_listings(self):
+        """Request the listing pages held back by LISTING_MAX_BACKLOG, and return how many were requested."""
+        count = 0
+        for request in self.next_listings():
+            self.crawler.engine.crawl(request)
+            count += 1
+        return count
+
+    def spider_idle(self):
+        # The listing pages held back are requested once the hotel pages are crawled, at the latest.
+        if self.pending_listings and self.resume_listings():
+            raise DontCloseSpider
+
+    def listing_request(self, city, page):
+        """Build the request of a listing page.
+
+        With SESSION_POOL_ENABLED, the listing page is requested right away, with whichever session of the pool
+        is available (see SessionPoolMiddleware). Otherwise, a new session is started on the homepage for it.
+        """
+        meta = dict(city=city, page=page)
+        if self.settings.getbool("DISTRIBUTED_ENABLED"):
+            # The listing page starts a new session: any worker can take it, and it is only requested once by all of them.
+            meta.update(frontier=True, frontier_key="listing|%s|%d" % (city, page))
+
+        if self.settings.getbool("SESSION_POOL_ENABLED"):
+            return Request(
+                url=urljoin(self.start_url, "cities?" + urlencode({"city": city, "page": page})),
+                callback=self.parse_listing,
+                errback=self.listing_errback,
+                meta=dict(meta, lease_session=True),
             )
 
+        return Request(
+            url=self.start_url,
+            callback=self.parse,
+            errback=self.listing_errback,
+            dont_filter=True,
+            meta=dict(meta, cookiejar="%s%d" % (city, page)),
+        )
+
+    @instrumented
     def parse(self, response):
-        """After accessing the website's homepage, we retrieve the list of hotels in Paris from page X."""
+        """After accessing the website's homepage, we retrieve the list of hotels in city X from page Y."""
+        # The session is started: its listing page goes before the pages starting a new session.
         yield Request(
-            url=response.urljoin("cities?city=paris&page=%d" % response.meta['page']),
+            url=response.urljoin("cities?" + urlencode({"city": response.meta['city'], "page": response.meta['page']})),
             callback=self.parse_listing,
-            errback=self.errback,
+            errback=self.listing_errback,
+            priority=self.settings.getint("HOTEL_PRIORITY", 0),
             meta=response.meta,
         )
 
+    @instrumented
     def parse_listing(self, response):
-        """This method parses the list of hotels in Paris from page X."""
-        for el in response.css('.hotel-link'):
-            yield response.follow(
-                url=el,
+        """This method parses the list of hotels in city X from page Y, and discovers the next listing pages.
+
+        The hotel pages get HOTEL_PRIORITY, above the pages starting a new session, so the items of a listing page
+        come before the next listing pages are expanded.
+        """
+        # In distributed mode, the listing page may have been requested by another worker.
+        self.listings_in_flight = max(0, self.listings_in_flight - 1)
+
+        entries = self.listing_entries(response)
+        if self.digests is not None:
+            page_key = "%s|%d" % (response.meta['city'], response.meta['page'])
+            to_follow = self.digests.filter_entries(page_key, entries)
+        else:
+            to_follow = entries
+
+        for url, reviews_count in to_follow:
+            yield Request(
+                url=url,
                 callback=self.parse_hotel,
                 errback=self.errback,
-                meta=response.meta,
+                priority=self.settings.getint("HOTEL_PRIORITY", 0),
+                meta=dict(response.meta, listing_entry=(url, reviews_count)),
             )
 
+        self.discover_pages(response, bool(entries))
+        yield from self.next_listings()
+
+    def listing_entries(self, response):
+        """Return the hotel URLs of a listing page with their review count as shown on the listing, in order."""
+        cards = response.css('.hotel-card')
+        if not cards:
+            return [(response.urljoin(href), None) for href in response.css('.hotel-link::attr(href)').getall()]
+
+        return [
+            (response.urljoin(card.css('.hotel-link::attr(href)').get()), card.css('.hotel-reviews-count::text').get())
+            for card in cards
+            if card.css('.hotel-link::attr(href)').get()
+        ]
+
+    def discover_pages(self, response, has_hotels):
+        """Schedule the listing pages of the city found in the pagination links.
+
+        Without pagination, the next page is probed as long as the listing isn't empty.
+        """
+        city, page = response.meta['city'], response.meta['page']
+        # In distributed mode, the pages of the city may have been scheduled by another worker.
+        self.known_pages.setdefault(city, page)
+
+        pages = []
+        for href in response.css('.pagination a.page-link::attr(href)').getall():
+            query = parse_qs(urlsplit(href).query)
+            if query.get('city', [city])[0] == city and query.get('page', [''])[0].isdigit():
+                pages.append(int(query['page'][0]))
+
+        if pages:
+            last = max(pages)
+        else:
+            last = page + 1 if has_hotels else page
+            self.crawler.stats.inc_value("listing/probes", last - page)
+
+        for new_page in range(self.known_pages[city] + 1, last + 1):
+            self.pending_listings.append((city, new_page))
+            self.crawler.stats.inc_value("listing/discovered")
+        self.known_pages[city] = max(self.known_pages[city], last)
+
+    @instrumented
+    def listing_errback(self, failure):
+        """This method handles the errors of the homepage and listing requests, and requests the next listing pages."""
+        self.listings_in_flight = max(0, self.listings_in_flight - 1)
+        self.failures.record(failure)
+        yield from self.next_listings()
+
+    @instrumented
     def parse_hotel(self, response):
-        """This method parses hotel details such as name, email, and reviews."""
-        reviews = [self.get_review(review_el) for review_el in response.css('.hotel-review')]
+        """This method parses hotel details such as name, email, and reviews.
+
+        With PARSE_POOL_ENABLED, large pages are extracted in a process pool and the item is returned by a coroutine,
+        see scrapers/parsing.py.
+        """
+        if self.pending_listings:
+            self.resume_listings()
+
+        if self.parser_pool is not None:
+            if self.parser_pool.offloads(response):
+                return self.parse_hotel_in_pool(response)
+            self.crawler.stats.inc_value("parse_pool/inline")
+
+        if self.settings.getbool("FAST_EXTRACTION"):
+            item = extract_hotel(response.selector.root)
+        else:
+            item = load_hotel(response.selector)
+        self.record_hotel(response)
+        return item
+
+    async def parse_hotel_in_pool(self, response):
+        item = await maybe_deferred_to_future(self.parser_pool.extract(response))
+        self.record_hotel(response)
+        return item
 
-        hotel = HotelItemLoader(response=response)
-        hotel.add_css('name', '.hotel-name::text')
-        hotel.add_css('email', '.hotel-email::text')
-        hotel.add_value('reviews', reviews)
-        return hotel.load_item()
+    def record_hotel(self, response):
+        if self.digests is not None and 'listing_entry' in response.meta:
+            self.digests.record_entry(*response.meta['listing_entry'])
 
     def get_review(self, review_el):
         """This method extracts rating from a review"""
-        review = ReviewItemLoader(selector=review_el)
-        review.add_css('rating', '.review-rating::text')
-        return review.load_item()
+        return load_review(review_el)
 
+    @instrumented
     def errback(self, failure):
-        """This method handles and logs errors and is invoked with each request."""
-        print_failure(self.logger, failure)
+        """This method handles errors and is invoked with each request. They are reported periodically, see FailureAggregator."""
+        self.failures.record(failure)
@@ -0,0 +1,97 @@
+"""
+A TLS context factory which resumes the TLS sessions of a crawling session, to cut the cost of the
+handshakes when the connections are closed after each request.
+
+Each crawling session (host, cookiejar and proxy, see scrapers.middlewares.throttle.get_session_key)
+gets its own factory from scrapers.handlers.SessionDownloadHandler, which keeps the last TLS session
+(or session ticket) to each host and offers it on the next connection, so a resumed session never
+crosses crawling sessions or proxy exits. The handshakes are reported in the stats: tls/full and
+tls/resumed count them, and tls/handshake_ms is a histogram of their duration.
+
+OpenSSL 3 discards a session when the server closes the connection without a TLS close_notify
+alert, which most servers send: against one which doesn't, every handshake is a full one.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from OpenSSL import SSL
+from scrapy.core.downloader.contextfactory import ScrapyClientContextFactory
+from scrapy.core.downloader.tls import ScrapyClientTLSOptions
+from scrapy.statscollectors import StatsCollector
+
+from scrapers.middlewares.info import record_duration
+
+
+class ResumingTLSOptions(ScrapyClientTLSOptions):
+    """TLS options of a host, offering the last session to the host on each new connection.
+
+    OpenSSL only resumes a session with the context which created it, so the options (and their
+    context) are kept for all the connections of a session to the host.
+    """
+
+    def __init__(self, hostname: str, ctx: SSL.Context, factory: SessionResumingContextFactory,
+                 verbose_logging: bool = False):
+        super().__init__(hostname, ctx, verbose_logging=verbose_logging)
+        self.factory = factory
+        self.session: Optional[SSL.Session] = None
+        self._started: WeakKeyDictionary[SSL.Connection, float] = WeakKeyDictionary()
+
+    def clientConnectionForTLS(self, tlsProtocol: Any) -> SSL.Connection:
+        connection = super().clientConnectionForTLS(tlsProtocol)
+        if self.session is not None:
+            connection.set_session(self.session)
+        self._started[connection] = time.monotonic()
+        return connection
+
+    def _identityVerifyingInfoCallback(self, connection: SSL.Connection, where: int, ret: Any) -> None:
+        # The info callback Twisted installs on the context, which ScrapyClientTLSOptions overrides as well.
+        super()._identityVerifyingInfoCallback(connection, where, ret)
+        if where & SSL.SSL_CB_HANDSHAKE_DONE:
+            self.session = connection.get_session()
+            started = self._started.pop(connection, None)
+            if started is not None:
+                self.factory.record_handshake(connection, time.monotonic() - started)
+        elif where & SSL.SSL_CB_LOOP and connection not in self._started:
+            # With TLS 1.3, the session tickets arrive after the handshake, each of them replacing
+            # the session of the connection.
+            self.session = connection.get_session()
+
+
+class SessionResumingContextFactory(ScrapyClientContextFactory):
+    def __init__(self, *args: Any, stats: Optional[StatsCollector] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.options: Dict[Tuple[bytes, int], ResumingTLSOptions] = {}
+
+    def creatorForNetloc(self, hostname: bytes, port: int) -> ResumingTLSOptions:
+        options = self.options.get((hostname, port))
+        if options is None:
+            options = self.options[hostname, port] = ResumingTLSOptions(
+                hostname.decode("ascii"),
+                self.getContext(),
+                self,
+                verbose_logging=self.tls_verbose_logging,
+            )
+        return options
+
+    def record_handshake(self, connection: SSL.Connection, duration: float) -> None:
+        if self.stats is None:
+            return
+        reused = self._session_reused(connection)
+        self.stats.inc_value("tls/handshakes" if reused is None else "tls/resumed" if reused else "tls/full")
+        record_duration(self.stats, "tls/handshake_ms", duration * 1000)
+
+    @staticmethod
+    def _session_reused(connection: SSL.Connection) -> Optional[bool]:
+        """Return whether the handshake resumed a session, or None if it can't be told."""
+        # pyOpenSSL doesn't expose SSL_session_reused(): only the stats depend on its internals.
+        try:
+            from OpenSSL._util import lib
+
+            return bool(lib.SSL_session_reused(connection._ssl))
+        except (ImportError, AttributeError):
+            return None
@@ -1,6 +1,12 @@
+from array import array
 from base64 import b64encode
+from collections import Counter, defaultdict
 from datetime import datetime
+from functools import lru_cache
+from scrapy import signals
 from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import task
+from urllib.parse import parse_qsl, urlsplit
 from w3lib.html import remove_tags
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Hash import SHA256
@@ -8,6 +14,8 @@ from Crypto.PublicKey import RSA
 
 import re
 import json
+import random
+import threading
 
 
 def remove_whitespace(text):
@@ -16,14 +24,58 @@ def remove_whitespace(text):
     return text.strip()
 
 
+DATE_FORMAT = '%b %d, %Y, %I:%M %p'
+DATE_RE = re.compile(r'([A-Za-z]{3})\s+(\d{1,2}),\s+(\d{4}),\s+(\d{1,2}):(\d{2})\s+([AaPp][Mm])')
+MONTHS = {
+    name: number
+    for number, name in enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)
+}
+
+# Stored in place of the dates which can't be parsed by dates_to_timestamps.
+MISSING_TIMESTAMP = -2 ** 63
+
+
+@lru_cache(maxsize=4096)
 def date_to_timestamp(date):
+    """Convert a date such as 'Jan 05, 2024, 03:45 PM', in local time, to a timestamp in milliseconds.
+
+    The format is parsed by hand as strptime is slow, and the result is cached as review dates repeat a lot.
+    Other spellings accepted by strptime go through it. Return None if the date can't be parsed.
+    """
+    date = date.strip()
+    match = DATE_RE.fullmatch(date)
+    if match is None:
+        try:
+            return int(datetime.strptime(date, DATE_FORMAT).timestamp() * 1000)
+        except ValueError:
+            return None
+
+    month, day, year, hour, minute, meridiem = match.groups()
+    month = MONTHS.get(month.lower())
+    hour = int(hour)
+    if month is None or not 1 <= hour <= 12:
+        return None
+    hour = hour % 12 + (12 if meridiem.upper() == 'PM' else 0)
+
     try:
-        return int(datetime.strptime(date.strip(), '%b %d, %Y, %I:%M %p').timestamp() * 1000)
+        return int(datetime(int(year), month, int(day), hour, int(minute)).timestamp() * 1000)
     except ValueError:
         return None
 
 
-def print_failure(logger, failure):
+def dates_to_timestamps(dates):
+    """Convert the dates of a page to an array of int64 timestamps in milliseconds, see date_to_timestamp.
+
+    Dates which can't be parsed are stored as MISSING_TIMESTAMP.
+    """
+    timestamps = array('q')
+    for date in dates:
+        timestamp = date_to_timestamp(date)
+        timestamps.append(MISSING_TIMESTAMP if timestamp is None else timestamp)
+    return timestamps
+
+
+def format_failure(failure):
     message = f"\nURL: {failure.request.url}\n\n"
 
     if failure.check(HttpError):
@@ -50,19 +102,148 @@ def print_failure(logger, failure):
     else:
         message += f"Error: {failure.getErrorMessage()}\n"
 
-    logger.error(f"\n{message}\n")
+    return message
 
 
-def rsa_encrypt(message, public_key):
-    """Use RSA public key encryption to encrypt the message."""
-
+def print_failure(logger, failure):
+    logger.error(f"\n{format_failure(failure)}\n")
+
+
+NUMBER_RE = re.compile(r'\d+')
+
+
+@lru_cache(maxsize=4096)
+def url_pattern(url):
+    """Return the path of the URL with numbers replaced by {n}, and the names of its query parameters."""
+    parts = urlsplit(url)
+    pattern = NUMBER_RE.sub('{n}', parts.path) or '/'
+    if parts.query:
+        pattern += '?' + '&'.join(sorted(f"{name}=" for name, _ in parse_qsl(parts.query, keep_blank_values=True)))
+    return pattern
+
+
+class FailureAggregator:
+    """Aggregate failures by error (HTTP status or exception) and URL pattern, instead of logging each of them.
+
+    Recording a failure only increments a counter, and formats it if it is picked for the small
+    reservoir of samples kept per group (FAILURE_SAMPLES). A summary of the new failures is logged
+    every FAILURE_REPORT_INTERVAL seconds, and a final report with the samples when the spider closes.
+    """
+
+    max_groups = 10
+    max_sample_length = 1000
+
+    def __init__(self, logger, stats=None, interval=60.0, max_samples=3):
+        self.logger = logger
+        self.stats = stats
+        self.interval = interval
+        self.max_samples = max_samples
+
+        self.counts = Counter()
+        self.samples = defaultdict(list)
+        self._reported = Counter()
+        self._task = None
+
+    @classmethod
+    def from_crawler(cls, crawler, logger):
+        settings = crawler.settings
+        aggregator = cls(
+            logger,
+            interval=settings.getfloat('FAILURE_REPORT_INTERVAL', 60.0),
+            max_samples=settings.getint('FAILURE_SAMPLES', 3),
+        )
+        crawler.signals.connect(aggregator.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(aggregator.spider_closed, signal=signals.spider_closed)
+        return aggregator
+
+    def spider_opened(self, spider):
+        # The stats collector of the crawler doesn't exist yet when the spider is created.
+        if self.stats is None:
+            self.stats = spider.crawler.stats
+        if self.interval > 0:
+            self._task = task.LoopingCall(self.report)
+            self._task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        self.final_report()
+
+    def record(self, failure):
+        if failure.check(HttpError):
+            error = str(failure.value.response.status)
+        else:
+            error = failure.type.__name__
+        key = (error, url_pattern(failure.request.url))
+
+        count = self.counts[key] = self.counts[key] + 1
+        if self.stats is not None:
+            self.stats.inc_value(f"failures/{error}")
+
+        # Reservoir sampling: every failure of the group has the same chance to be kept.
+        samples = self.samples[key]
+        if len(samples) < self.max_samples:
+            samples.append(format_failure(failure)[:self.max_sample_length])
+        else:
+            index = random.randrange(count)
+            if index < self.max_samples:
+                samples[index] = format_failure(failure)[:self.max_sample_length]
+
+    def report(self):
+        """Log the failures since the last report."""
+        new = self.counts - self._reported
+        if not new:
+            return
+
+        self._reported = self.counts.copy()
+        self.logger.warning(
+            "%d failures in the last %.0fs:\n%s", sum(new.values()), self.interval, self._format_counts(new)
+        )
+
+    def final_report(self):
+        if not self.counts:
+            return
+
+        lines = [self._format_counts(self.counts)]
+        for key, _ in self.counts.most_common(self.max_groups):
+            for sample in self.samples[key]:
+                lines.append(f"Sample of {key[0]} {key[1]}:{sample}")
+        self.logger.error("%d failures:\n%s", sum(self.counts.values()), '\n'.join(lines))
+
+    def _format_counts(self, counts):
+        lines = [f"  {count:>6}  {error} {pattern}" for (error, pattern), count in counts.most_common(self.max_groups)]
+        others = len(counts) - self.max_groups
+        if others > 0:
+            lines.append(f"  ... and {others} other groups")
+        return '\n'.join(lines)
+
+
+@lru_cache(maxsize=None)
+def load_public_key(public_key):
+    """Parse a base64 DER public key, as found in the website's JavaScript code, once."""
     # Convert the public key into PEM format for use in RSA encryption.
     pem_key = f"-----BEGIN PUBLIC KEY-----\n{public_key}\n-----END PUBLIC KEY-----"
-    rsa_public_key = RSA.importKey(pem_key)
-    rsa_public_key = PKCS1_OAEP.new(rsa_public_key, hashAlgo=SHA256)
+    return RSA.importKey(pem_key)
+
 
-    # Encrypt the message
-    message = str.encode(message)
-    encrypted_text = rsa_public_key.encrypt(message)
+_ciphers = threading.local()
+
+
+def get_cipher(public_key):
+    """Return the RSA-OAEP cipher of the public key, cached per thread as cipher objects are not thread-safe."""
+    try:
+        cache = _ciphers.cache
+    except AttributeError:
+        cache = _ciphers.cache = {}
+
+    cipher = cache.get(public_key)
+    if cipher is None:
+        cipher = cache[public_key] = PKCS1_OAEP.new(load_public_key(public_key), hashAlgo=SHA256)
+    return cipher
+
+
+def rsa_encrypt(message, public_key):
+    """Use RSA public key encryption to encrypt the message."""
+    encrypted_text = get_cipher(public_key).encrypt(str.encode(message))
     encrypted_text_b64 = b64encode(encrypted_text)
     return encrypted_text_b64
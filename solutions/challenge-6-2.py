@@ -1,11 +1,17 @@
-from scrapy import FormRequest, Request, Spider
+from scrapy import FormRequest, Request, Spider, signals
+from scrapy.utils.defer import maybe_deferred_to_future
 from scrapers.items import HotelItemLoader, ReviewItemLoader
+from scrapers.payloads import PayloadPool
 from scrapers.utils import print_failure, rsa_encrypt
 from urllib.parse import urljoin
 
 import json
 
 
+# The public key is extracted from the deobfuscated JavaScript code of the website's antibot.
+PUBLIC_KEY = "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEApgjwxZd4I6YnOE1GGCdnKIatX71CyGpssvAAH7udNLcBVr0WzIP1t+KZ7mDzLMyZE9MJmSsEgKidzaVRikarUQ6MUWnyJQxe8DlUNrSmK4ZrnLBD/5rVBcepZo1mPj1MdQWie4AYHUt++lLpPrXqEJ7xugSGIt7ORVGgcKO5ku5RSS1Ssy5iUhYtQo4VCb2UxYuMbpt2YF8LOaR8KtPIQENtNH2Jj7akQTna4I5lixOB0jme03lR5n94SqACUAZ+rFBDKgrC9eVWX8xdfMERxcKuD9NxFCV65tdNiH64CHWaDU13j9v2XGHKFkEORgRn+RQBintX5fEqt7GTTIzvoQIDAQAB"
+
+
 def build_payload():
     """Build the encrypted payload to send to the server."""
     payload = json.dumps({
@@ -13,10 +19,8 @@ def build_payload():
         "renderer": "Intel Iris OpenGL Engine",
     })
 
-    # The public key is extracted from the deobfuscated JavaScript code of the website's antibot.
-    public_key = "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEApgjwxZd4I6YnOE1GGCdnKIatX71CyGpssvAAH7udNLcBVr0WzIP1t+KZ7mDzLMyZE9MJmSsEgKidzaVRikarUQ6MUWnyJQxe8DlUNrSmK4ZrnLBD/5rVBcepZo1mPj1MdQWie4AYHUt++lLpPrXqEJ7xugSGIt7ORVGgcKO5ku5RSS1Ssy5iUhYtQo4VCb2UxYuMbpt2YF8LOaR8KtPIQENtNH2Jj7akQTna4I5lixOB0jme03lR5n94SqACUAZ+rFBDKgrC9eVWX8xdfMERxcKuD9NxFCV65tdNiH64CHWaDU13j9v2XGHKFkEORgRn+RQBintX5fEqt7GTTIzvoQIDAQAB"
-
-    payload_encoded = rsa_encrypt(payload, public_key)
+    # The key is parsed once and the cipher is cached, see scrapers.utils.rsa_encrypt.
+    payload_encoded = rsa_encrypt(payload, PUBLIC_KEY)
     return payload_encoded
 
 
@@ -44,6 +48,17 @@ class TrekkySpider(Spider):
         },
     }
 
+    # Number of encrypted payloads built ahead of demand, outside of the event loop.
+    payload_pool_size = 50
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.payloads = PayloadPool(build_payload, size=spider.payload_pool_size)
+        crawler.signals.connect(spider.payloads.start, signal=signals.spider_opened)
+        crawler.signals.connect(spider.payloads.close, signal=signals.spider_closed)
+        return spider
+
     def start_requests(self):
         """This method start 10 separate sessions on the homepage, one per page."""
         for page in range(1, 10):
@@ -58,12 +73,13 @@ class TrekkySpider(Spider):
                 ),
             )
 
-    def parse_home(self, response):
-        """After accessing the website's homepage, we generate the encrypted payload and send it to the server."""
+    async def parse_home(self, response):
+        """After accessing the website's homepage, we take an encrypted payload from the pool and send it to the server."""
+        payload = await maybe_deferred_to_future(self.payloads.get())
         yield FormRequest(
             url=urljoin(self.start_url, '/Vmi6869kJM7vS70sZKXrwn5Lq0CORjRl'),
             formdata={
-                "payload": build_payload(),
+                "payload": payload,
             },
             callback=self.parse,
             errback=self.errback,
@@ -0,0 +1,99 @@
+import logging
+from types import SimpleNamespace
+
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+from scrapers.incremental import ListingDigests
+
+
+ENTRIES = [('https://example.com/hotels/1', '3'), ('https://example.com/hotels/2', '5')]
+
+
+class Crawl:
+    """One crawl of the listing pages against the digests stored in *path*."""
+
+    def __init__(self, path, force_full=False):
+        self.stats = MemoryStatsCollector(SimpleNamespace(settings=Settings()))
+        self.spider = SimpleNamespace(crawler=SimpleNamespace(stats=self.stats), logger=logging.getLogger('test'))
+        self.digests = ListingDigests(str(path), force_full=force_full)
+        self.digests.spider_opened(self.spider)
+
+    def follow(self, page_key, entries, parsed=None):
+        """Filter the entries of a listing page, and record the hotels followed (or only those of *parsed*)."""
+        followed = self.digests.filter_entries(page_key, entries)
+        for entry in followed:
+            if parsed is None or entry[0] in parsed:
+                self.digests.record_entry(*entry)
+        return followed
+
+    def close(self, reason='finished'):
+        self.digests.spider_closed(self.spider, reason)
+
+
+def test_first_crawl_is_full_and_the_next_one_skips_unchanged_pages(tmp_path):
+    path = tmp_path / 'incremental.db'
+    crawl = Crawl(path)
+    assert crawl.digests.full
+    assert crawl.follow('paris|1', ENTRIES) == ENTRIES
+    crawl.close()
+
+    crawl = Crawl(path)
+    assert not crawl.digests.full
+    assert crawl.follow('paris|1', ENTRIES) == []
+    assert crawl.stats.get_value('incremental/pages_unchanged') == 1
+    assert crawl.stats.get_value('incremental/skipped') == 2
+    crawl.close()
+
+
+def test_only_the_changed_entries_are_followed(tmp_path):
+    path = tmp_path / 'incremental.db'
+    crawl = Crawl(path)
+    crawl.follow('paris|1', ENTRIES)
+    crawl.close()
+
+    changed = [ENTRIES[0], ('https://example.com/hotels/2', '6'), ('https://example.com/hotels/3', '1')]
+    crawl = Crawl(path)
+    assert crawl.follow('paris|1', changed) == changed[1:]
+    crawl.close()
+
+    crawl = Crawl(path)
+    assert crawl.follow('paris|1', changed) == []
+    crawl.close()
+
+
+def test_a_page_with_a_failed_hotel_is_checked_again(tmp_path):
+    path = tmp_path / 'incremental.db'
+    crawl = Crawl(path)
+    crawl.follow('paris|1', ENTRIES, parsed={ENTRIES[0][0]})
+    crawl.close()
+
+    crawl = Crawl(path)
+    assert crawl.follow('paris|1', ENTRIES) == ENTRIES[1:]
+    crawl.close()
+
+    crawl = Crawl(path)
+    assert crawl.follow('paris|1', ENTRIES) == []
+    crawl.close()
+
+
+def test_full_crawl_follows_every_entry(tmp_path):
+    path = tmp_path / 'incremental.db'
+    crawl = Crawl(path)
+    crawl.follow('paris|1', ENTRIES)
+    crawl.close()
+
+    crawl = Crawl(path, force_full=True)
+    assert crawl.follow('paris|1', ENTRIES) == ENTRIES
+    crawl.close()
+
+
+def test_an_interrupted_full_crawl_is_full_again(tmp_path):
+    path = tmp_path / 'incremental.db'
+    crawl = Crawl(path)
+    crawl.follow('paris|1', ENTRIES)
+    crawl.close('shutdown')
+
+    crawl = Crawl(path)
+    assert crawl.digests.full
+    crawl.close()
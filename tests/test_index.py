@@ -0,0 +1,59 @@
+from array import array
+
+from scrapers.index import HashIndex
+
+
+def read_hashes(path):
+    hashes = array('Q')
+    hashes.frombytes(path.read_bytes())
+    return list(hashes)
+
+
+def test_add_and_contains(tmp_path):
+    index = HashIndex(str(tmp_path / 'hotels.idx'))
+    assert index.add('url:a')
+    assert not index.add('url:a')
+    assert 'url:a' in index
+    assert 'url:b' not in index
+    assert len(index) == 1
+    index.close()
+
+
+def test_save_merges_the_added_keys_in_order(tmp_path):
+    path = tmp_path / 'hotels.idx'
+    index = HashIndex(str(path))
+    for i in range(0, 100, 2):
+        index.add(f'url:{i}')
+    index.save()
+    index.close()
+
+    index = HashIndex(str(path))
+    assert len(index) == 50
+    assert 'url:10' in index
+    assert not index.add('url:10')
+    for i in range(1, 100, 2):
+        assert index.add(f'url:{i}')
+    index.save()
+    index.close()
+
+    hashes = read_hashes(path)
+    assert hashes == sorted(HashIndex.hash_key(f'url:{i}') for i in range(100))
+
+    index = HashIndex(str(path))
+    assert all(f'url:{i}' in index for i in range(100))
+    assert 'url:100' not in index
+    index.close()
+
+
+def test_save_without_new_keys_keeps_the_file(tmp_path):
+    path = tmp_path / 'hotels.idx'
+    index = HashIndex(str(path))
+    index.save()
+    assert not path.exists()
+
+    index.add('url:a')
+    index.save()
+    before = path.read_bytes()
+    index.save()
+    assert path.read_bytes() == before
+    index.close()
@@ -0,0 +1,31 @@
+import pickle
+
+from scrapers.items import HotelItem, ReviewItem, ReviewList, item_to_dict
+
+
+def test_review_list_round_trip():
+    reviews = ReviewList.from_reviews([ReviewItem(rating=4.5), ReviewItem(rating=None), {'rating': 3.0}])
+
+    assert len(reviews) == 3
+    assert reviews.values() == [4.5, None, 3.0]
+    assert reviews[1] == ReviewItem(rating=None)
+    assert list(reviews) == [ReviewItem(rating=4.5), ReviewItem(rating=None), ReviewItem(rating=3.0)]
+    assert reviews.to_list() == [{'rating': 4.5}, {'rating': None}, {'rating': 3.0}]
+    assert ReviewList(reviews.values()) == reviews
+
+
+def test_review_list_slices_and_bytes():
+    reviews = ReviewList([1.0, None, 5.0])
+    assert reviews[1:] == ReviewList([None, 5.0])
+    assert reviews == [ReviewItem(rating=1.0), ReviewItem(rating=None), ReviewItem(rating=5.0)]
+
+    copy = ReviewList()
+    copy.ratings.frombytes(reviews.ratings.tobytes())
+    assert copy == reviews
+    assert pickle.loads(pickle.dumps(reviews)) == reviews
+
+
+def test_item_to_dict():
+    item = HotelItem(name='Hotel', email='hotel@example.com', reviews=ReviewList([4.0]))
+    assert item_to_dict(item) == {'name': 'Hotel', 'email': 'hotel@example.com', 'reviews': [{'rating': 4.0}]}
+    assert item_to_dict(HotelItem(name='Empty'))['reviews'] is None
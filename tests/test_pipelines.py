@@ -0,0 +1,164 @@
+import csv
+import gzip
+import json
+import queue
+
+import pyarrow.parquet as pq
+import pytest
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+from scrapers.items import HotelItem, ReviewList
+from scrapers.pipelines import buffered
+from scrapers.pipelines.csv import SaveToCsvPipeline
+from scrapers.pipelines.jsonl import SaveToJsonLinesPipeline
+from scrapers.pipelines.parquet import SaveToParquetPipeline
+
+
+def make_item(i):
+    return HotelItem(name=f'Hotel {i}', email=f'hotel{i}@example.com', reviews=ReviewList([4.5, None]))
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_csv_streaming_flushes_every_flush_items(tmp_path):
+    path = tmp_path / 'results.csv'
+    pipeline = SaveToCsvPipeline(filename=str(path), streaming=True, flush_items=2, flush_interval=3600)
+    pipeline.spider_opened(None)
+
+    pipeline.process_item(make_item(1), None)
+    assert read_csv(path) == []
+
+    pipeline.process_item(make_item(2), None)
+    assert [row['name'] for row in read_csv(path)] == ['Hotel 1', 'Hotel 2']
+
+    pipeline.process_item(make_item(3), None)
+    pipeline.spider_closed(None)
+    rows = read_csv(path)
+    assert [row['name'] for row in rows] == ['Hotel 1', 'Hotel 2', 'Hotel 3']
+    assert rows[0]['reviews'] == str([{'rating': 4.5}, {'rating': None}])
+
+
+def test_csv_without_streaming_writes_on_close(tmp_path):
+    path = tmp_path / 'results.csv'
+    pipeline = SaveToCsvPipeline(filename=str(path), streaming=False)
+    pipeline.spider_opened(None)
+
+    for i in range(3):
+        pipeline.process_item(make_item(i), None)
+    assert not path.exists()
+
+    pipeline.spider_closed(None)
+    assert len(read_csv(path)) == 3
+
+
+def test_jsonl_keeps_the_reviews_structured(tmp_path):
+    path = tmp_path / 'results.jsonl.gz'
+    pipeline = SaveToJsonLinesPipeline(filename=str(path), streaming=True, flush_items=1, flush_interval=3600)
+    pipeline.spider_opened(None)
+    pipeline.process_item(make_item(1), None)
+    pipeline.process_item(HotelItem(name='Empty'), None)
+    pipeline.spider_closed(None)
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines == [
+        {'name': 'Hotel 1', 'email': 'hotel1@example.com', 'reviews': [{'rating': 4.5}, {'rating': None}]},
+        {'name': 'Empty', 'email': None, 'reviews': None},
+    ]
+
+
+def test_parquet_flattens_the_reviews(tmp_path):
+    hotels_path, reviews_path = tmp_path / 'hotels.parquet', tmp_path / 'reviews.parquet'
+    pipeline = SaveToParquetPipeline(
+        filename=str(hotels_path), reviews_filename=str(reviews_path), streaming=True, flush_items=2,
+        flush_interval=3600,
+    )
+    pipeline.spider_opened(None)
+    for item in (make_item(1), HotelItem(name='Empty'), make_item(3)):
+        pipeline.process_item(item, None)
+    pipeline.spider_closed(None)
+
+    hotels = pq.read_table(hotels_path)
+    assert hotels.num_rows == 3
+    # One row group per flush.
+    assert pq.ParquetFile(hotels_path).num_row_groups == 2
+    assert hotels.column('reviews_count').to_pylist() == [2, 0, 2]
+
+    reviews = pq.read_table(reviews_path).to_pydict()
+    assert reviews == {'hotel_id': [0, 0, 2, 2], 'rating': [4.5, None, 4.5, None]}
+
+
+class ImmediateReactor:
+    """Runs the calls the writer thread makes to the reactor right away, in the writer thread."""
+
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+def stop_writer(pipeline):
+    """Stop the writer thread as spider_closed does, without a running reactor."""
+    pipeline._overflow.append((buffered._STOP, None))
+    pipeline._drain_overflow()
+    pipeline._thread.join(5)
+    assert not pipeline._thread.is_alive()
+
+
+def test_writer_thread_writes_the_items(tmp_path):
+    path = tmp_path / 'results.csv'
+    pipeline = SaveToCsvPipeline(filename=str(path), streaming=True, flush_items=2, writer_thread=True)
+    pipeline.spider_opened(None)
+    for i in range(5):
+        assert pipeline.process_item(make_item(i), None).name == f'Hotel {i}'
+    stop_writer(pipeline)
+
+    assert [row['name'] for row in read_csv(path)] == [f'Hotel {i}' for i in range(5)]
+
+
+def test_writer_thread_holds_the_items_while_the_queue_is_full():
+    pipeline = SaveToCsvPipeline(writer_thread=True, writer_queue_size=1)
+    # Without the writer thread, to control when the queue is drained.
+    pipeline._queue = queue.Queue(maxsize=1)
+
+    first, second = make_item(1), make_item(2)
+    assert pipeline.process_item(first, None) is first
+    d = pipeline.process_item(second, None)
+    assert isinstance(d, Deferred) and not d.called
+
+    assert pipeline._queue.get_nowait() is first
+    pipeline._drain_overflow()
+    assert d.result is second
+
+
+def test_writer_failure_fails_the_held_items():
+    pipeline = SaveToCsvPipeline(writer_thread=True, writer_queue_size=1)
+    pipeline._queue = queue.Queue(maxsize=1)
+    pipeline.process_item(make_item(1), None)
+    d = pipeline.process_item(make_item(2), None)
+    errors = []
+    d.addErrback(errors.append)
+
+    pipeline._writer_failed(Failure(OSError(28, 'No space left on device')))
+    assert errors and errors[0].check(OSError)
+    with pytest.raises(OSError):
+        pipeline.process_item(make_item(3), None)
+
+
+def test_failed_flush_stops_the_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(buffered, 'reactor', ImmediateReactor())
+
+    class FailingPipeline(SaveToCsvPipeline):
+        def write_items(self, items):
+            raise OSError(28, 'No space left on device')
+
+    pipeline = FailingPipeline(filename=str(tmp_path / 'results.csv'), flush_items=1, writer_thread=True)
+    pipeline.spider_opened(None)
+    pipeline.process_item(make_item(1), None)
+    pipeline._thread.join(5)
+
+    assert not pipeline._thread.is_alive()
+    with pytest.raises(OSError):
+        pipeline.process_item(make_item(2), None)
@@ -0,0 +1,51 @@
+from datetime import datetime
+import random
+
+import pytest
+
+from scrapers.utils import MISSING_TIMESTAMP, date_to_timestamp, dates_to_timestamps
+
+
+def strptime_timestamp(date):
+    try:
+        return int(datetime.strptime(date.strip(), '%b %d, %Y, %I:%M %p').timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def test_date_to_timestamp_matches_strptime():
+    rng = random.Random(0)
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    for _ in range(2000):
+        date = '%s %02d, %d, %02d:%02d %s' % (
+            rng.choice(months), rng.randint(1, 31), rng.randint(1990, 2030), rng.randint(1, 12), rng.randint(0, 59),
+            rng.choice(['AM', 'PM']),
+        )
+        assert date_to_timestamp(date) == strptime_timestamp(date), date
+
+
+@pytest.mark.parametrize('date', [
+    'Jan 05, 2024, 12:00 AM',
+    'Jan 05, 2024, 12:30 PM',
+    'Jan 5, 2024, 3:45 pm',
+    'jan 05, 2024, 03:45 PM',
+    '  Dec 31, 1999, 11:59 PM ',
+    'Feb 29, 2024, 01:00 AM',
+    # Invalid dates.
+    'Feb 29, 2023, 01:00 AM',
+    'Feb 30, 2024, 01:00 PM',
+    'Jan 05, 2024, 13:00 PM',
+    'Jan 05, 2024, 00:10 AM',
+    'Jan 05, 2024, 10:60 AM',
+    'Foo 05, 2024, 10:00 AM',
+    'Jan 05 2024 10:00 AM',
+    '',
+])
+def test_date_to_timestamp_edge_cases(date):
+    assert date_to_timestamp(date) == strptime_timestamp(date)
+
+
+def test_dates_to_timestamps():
+    timestamps = dates_to_timestamps(['Jan 05, 2024, 03:45 PM', 'not a date'])
+    assert timestamps.typecode == 'q'
+    assert list(timestamps) == [strptime_timestamp('Jan 05, 2024, 03:45 PM'), MISSING_TIMESTAMP]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Compare the review date parsers of scrapers.utils with the original strptime version.
+
+Dates are drawn from a small set of distinct values, as review dates repeat a lot on the website.
+
+Usage:
+    python tools/bench_dates.py
+    python tools/bench_dates.py --dates 100000 --distinct 50000
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import argparse
+import random
+import sys
+import timeit
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from scrapers.utils import date_to_timestamp, dates_to_timestamps  # noqa: E402
+
+
+def strptime_date_to_timestamp(date):
+    """The original implementation of scrapers.utils.date_to_timestamp."""
+    try:
+        return int(datetime.strptime(date.strip(), '%b %d, %Y, %I:%M %p').timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def generate_dates(count, distinct, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    values = [
+        (start + timedelta(minutes=rng.randrange(5 * 365 * 24 * 60))).strftime('%b %d, %Y, %I:%M %p')
+        for _ in range(distinct)
+    ]
+    return [rng.choice(values) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dates', type=int, default=50000, help='number of dates to parse')
+    parser.add_argument('--distinct', type=int, default=1000, help='number of distinct dates')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    dates = generate_dates(args.dates, args.distinct)
+
+    expected = [strptime_date_to_timestamp(date) for date in dates]
+    assert [date_to_timestamp(date) for date in dates] == expected
+    assert list(dates_to_timestamps(dates)) == expected
+
+    def uncached():
+        # The hand-rolled parser alone, without the benefit of the cache.
+        parse = date_to_timestamp.__wrapped__
+        return [parse(date) for date in dates]
+
+    def cold_cache():
+        date_to_timestamp.cache_clear()
+        return dates_to_timestamps(dates)
+
+    benchmarks = [
+        ('strptime', lambda: [strptime_date_to_timestamp(date) for date in dates]),
+        ('hand-rolled', uncached),
+        ('cached, cold', cold_cache),
+        ('cached, warm', lambda: dates_to_timestamps(dates)),
+    ]
+
+    baseline = None
+    print(f"{'parser':<14}{'ns/date':>10}{'speed-up':>10}")
+    for name, function in benchmarks:
+        best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        per_date = best / len(dates) * 1e9
+        baseline = baseline or per_date
+        print(f"{name:<14}{per_date:>10.0f}{baseline / per_date:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
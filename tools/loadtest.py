@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Run the spiders against the local Trekky stand-in and report their throughput.
+
+Each configuration runs in its own process, from a temporary directory, and reports:
+pages/sec, items/sec, p50/p99 download latency, time to the first item, largest scheduler backlog,
+HTTP cache stores and hits, server-side connections and peak RSS. The HTTP cache starts empty, in the
+temporary directory.
+
+Usage:
+    python tools/loadtest.py
+    python tools/loadtest.py --level 3 --config fast: --config loaders:FAST_EXTRACTION=False
+    python tools/loadtest.py --playwright
+    python tools/loadtest.py --workers 2 --workers 4
+
+A configuration is written as name:SETTING=value,SETTING=value and applies Scrapy settings to the trekky spider.
+With --workers N, each configuration also runs in distributed mode with N worker processes (see scrapers/distributed.py).
+"""
+from pathlib import Path
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'tools'))
+
+from trekky_server import create_server, parse_cities  # noqa: E402
+
+
+DEFAULT_CONFIGS = [
+    'loaders:FAST_EXTRACTION=False',
+    'fast:',
+    'writer-thread:CSV_WRITER_THREAD=True',
+]
+
+
+class LatencyRecorder:
+    """Scrapy extension recording the download latency of every response, the time of the first item and the largest
+    number of scheduled requests, for the load test worker."""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.latencies = []
+        self.first_item = None
+        self.max_pending = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+
+        recorder = cls(crawler)
+        crawler.signals.connect(recorder.response_received, signal=signals.response_received)
+        crawler.signals.connect(recorder.item_scraped, signal=signals.item_scraped)
+        crawler.loadtest_recorder = recorder
+        return recorder
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.latencies.append(latency)
+
+        slot = getattr(self.crawler.engine, '_slot', None)
+        if slot is not None:
+            self.max_pending = max(self.max_pending, len(slot.scheduler))
+
+    def item_scraped(self, item, response, spider):
+        if self.first_item is None:
+            self.first_item = time.perf_counter()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_scrapy_worker(start_url, cities, settings_overrides, output):
+    """Run the trekky spider in this process and write its metrics to output."""
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'scrapers.settings')
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.set('LOG_LEVEL', 'WARNING')
+    settings.set('EXTENSIONS', {'loadtest.LatencyRecorder': 0, **settings.getdict('EXTENSIONS')})
+    for key, value in settings_overrides.items():
+        settings.set(key, value, priority='cmdline')
+    settings.set('HTTPCACHE_DIR', worker_cache_dir(settings.get('HTTPCACHE_DIR')), priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler('trekky')
+    process.crawl(crawler, start_url=start_url, cities=cities)
+
+    started = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - started
+
+    stats = crawler.stats.get_stats()
+    latencies = crawler.loadtest_recorder.latencies
+    Path(output).write_text(json.dumps({
+        'elapsed': elapsed,
+        'pages': stats.get('response_received_count', 0),
+        'items': stats.get('item_scraped_count', 0),
+        'p50': percentile(latencies, 0.50),
+        'p99': percentile(latencies, 0.99),
+        'first_item': crawler.loadtest_recorder.first_item - started if crawler.loadtest_recorder.first_item else None,
+        'max_pending': crawler.loadtest_recorder.max_pending,
+        'cache_stores': stats.get('httpcache/store', 0),
+        'cache_hits': stats.get('httpcache/hit', 0),
+    }))
+
+
+def worker_cache_dir(path):
+    """Return HTTPCACHE_DIR as an absolute path: Scrapy only places a relative one next to scrapy.cfg, which the
+    temporary directory of the worker doesn't have, and disables the cache otherwise."""
+    return os.path.abspath(path or 'httpcache')
+
+
+def run_distributed_worker(start_url, cities, settings_overrides, workers, output):
+    """Run the trekky spider in distributed mode from this process and write its metrics to output."""
+    import csv
+    from scrapers.distributed import crawl
+
+    settings = dict(settings_overrides, LOG_LEVEL='WARNING')
+    settings['HTTPCACHE_DIR'] = worker_cache_dir(settings.get('HTTPCACHE_DIR'))
+
+    started = time.perf_counter()
+    crawl('trekky', workers, [('start_url', start_url), ('cities', cities)], list(settings.items()))
+    elapsed = time.perf_counter() - started
+
+    with open('results.csv', newline='') as f:
+        items = sum(1 for _ in csv.DictReader(f))
+
+    Path(output).write_text(json.dumps({'elapsed': elapsed, 'pages': None, 'items': items, 'p50': None, 'p99': None}))
+
+
+def run_playwright_worker(start_url, cities, output):
+    """Run playwright_spider.py in this process and write its metrics to output."""
+    import asyncio
+    import csv
+    import playwright_spider
+
+    spider = playwright_spider.TrekkyPlaywrightSpider()
+    spider.start_url = start_url
+    spider.cities = cities.split(',')
+
+    started = time.perf_counter()
+    asyncio.run(spider.start())
+    elapsed = time.perf_counter() - started
+
+    with open('results.csv', newline='') as f:
+        items = sum(1 for _ in csv.DictReader(f))
+
+    Path(output).write_text(json.dumps({'elapsed': elapsed, 'pages': None, 'items': items, 'p50': None, 'p99': None}))
+
+
+def parse_config(value):
+    name, _, assignments = value.partition(':')
+    overrides = {}
+    for assignment in filter(None, assignments.split(',')):
+        key, _, setting = assignment.partition('=')
+        overrides[key.strip()] = setting.strip()
+    return name, overrides
+
+
+def server_counters(base_url, path):
+    with urllib.request.urlopen(base_url + path) as response:
+        return json.loads(response.read())
+
+
+def run_config(name, command, base_url):
+    """Run one worker process and collect its metrics, its peak RSS and the server-side page count."""
+    server_counters(base_url, '/__reset')
+
+    with tempfile.TemporaryDirectory(prefix=f'loadtest-{name}-') as workdir:
+        output = os.path.join(workdir, 'metrics.json')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), str(ROOT / 'tools')]))
+
+        process = subprocess.Popen([sys.executable, __file__, *command, '--output', output], cwd=workdir, env=env)
+        _, status, rusage = os.wait4(process.pid, 0)
+        if status != 0 or not os.path.exists(output):
+            return {'name': name, 'error': f'worker exited with status {status}'}
+
+        metrics = json.loads(Path(output).read_text())
+
+    counters = server_counters(base_url, '/__stats')
+    if metrics['pages'] is None:
+        metrics['pages'] = counters.get('requests', 0)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    elapsed = metrics['elapsed'] or float('nan')
+    return {
+        'name': name,
+        'elapsed': elapsed,
+        'pages': metrics['pages'],
+        'items': metrics['items'],
+        'pages_per_sec': metrics['pages'] / elapsed,
+        'items_per_sec': metrics['items'] / elapsed,
+        'p50_ms': metrics['p50'] * 1000 if metrics['p50'] is not None else None,
+        'p99_ms': metrics['p99'] * 1000 if metrics['p99'] is not None else None,
+        'first_item_s': metrics.get('first_item'),
+        'max_pending': metrics.get('max_pending'),
+        'cache_stores': metrics.get('cache_stores'),
+        'cache_hits': metrics.get('cache_hits'),
+        'rate_limited': counters.get('rate_limited', 0),
+        # Without the connection of this /__stats request.
+        'connections': counters.get('connections', 1) - 1,
+        'peak_rss_mb': rss / 1024 / 1024,
+    }
+
+
+def print_report(results):
+    columns = ['name', 'elapsed', 'pages', 'items', 'pages_per_sec', 'items_per_sec', 'p50_ms', 'p99_ms',
+               'first_item_s', 'max_pending', 'cache_stores', 'cache_hits', 'rate_limited', 'connections', 'peak_rss_mb']
+
+    def fmt(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return f'{value:.2f}'
+        return str(value)
+
+    rows = [[fmt(result.get(column)) for column in columns] for result in results if 'error' not in result]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)))
+
+    for result in results:
+        if 'error' in result:
+            print(f"{result['name']}: {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--level', type=int, default=1)
+    parser.add_argument('--cities', type=parse_cities, default={'paris': 9})
+    parser.add_argument('--hotels-per-page', type=int, default=6)
+    parser.add_argument('--max-reviews', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=2.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--config', action='append', help='name:SETTING=value,... (repeatable)')
+    parser.add_argument('--playwright', action='store_true', help='also run playwright_spider.py')
+    parser.add_argument('--workers', type=int, action='append', default=[],
+                        help='also run each configuration with this many worker processes (repeatable)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+
+    # Internal arguments, used by the worker processes.
+    parser.add_argument('--worker', choices=['scrapy', 'distributed', 'playwright'], help=argparse.SUPPRESS)
+    parser.add_argument('--worker-processes', type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument('--start-url', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-cities', help=argparse.SUPPRESS)
+    parser.add_argument('--settings', default='{}', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == 'scrapy':
+        return run_scrapy_worker(args.start_url, args.worker_cities, json.loads(args.settings), args.output)
+    if args.worker == 'distributed':
+        return run_distributed_worker(args.start_url, args.worker_cities, json.loads(args.settings),
+                                      args.worker_processes, args.output)
+    if args.worker == 'playwright':
+        return run_playwright_worker(args.start_url, args.worker_cities, args.output)
+
+    server = create_server(
+        port=0,
+        cities=args.cities,
+        hotels_per_page=args.hotels_per_page,
+        reviews=(0, args.max_reviews),
+        rate=args.rate,
+        latency=args.latency,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    start_url = f'{base_url}/level{args.level}'
+
+    results = []
+    for name, overrides in map(parse_config, args.config or DEFAULT_CONFIGS):
+        command = ['--worker', 'scrapy', '--start-url', start_url, '--worker-cities', ','.join(args.cities),
+                   '--settings', json.dumps(overrides)]
+        results.append(run_config(name, command, base_url))
+
+        for workers in args.workers:
+            command = ['--worker', 'distributed', '--worker-processes', str(workers), '--start-url', start_url,
+                       '--worker-cities', ','.join(args.cities), '--settings', json.dumps(overrides)]
+            results.append(run_config(f'{name}@{workers}', command, base_url))
+
+    if args.playwright:
+        command = ['--worker', 'playwright', '--start-url', start_url, '--worker-cities', ','.join(args.cities)]
+        results.append(run_config('playwright', command, base_url))
+
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
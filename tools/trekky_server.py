@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""A local stand-in for trekky-reviews.com, to benchmark the spiders without hitting the real website.
+
+It reproduces the page structure the spiders rely on (.hotel-link, .hotel-name, .hotel-email, .hotel-review,
+.review-rating) and the protections they handle:
+- cookie sessions: the homepage sets a session cookie, required from level 2,
+- rate limiting: from level 3, each session (or client address without session) gets a token bucket
+  and receives a 429 when it is empty,
+- antibot payload: from level 8, sessions must POST an encrypted payload to /Vmi6869kJM7vS70sZKXrwn5Lq0CORjRl.
+Hotel pages have an ETag and answer If-None-Match with a 304, to benchmark HTTP caches.
+
+Usage:
+    python tools/trekky_server.py --port 8888 --cities paris:9,lyon:3
+
+Then run a spider with: scrapy crawl trekky -a start_url=http://127.0.0.1:8888/level1
+"""
+from base64 import b64decode
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import argparse
+import binascii
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import zlib
+
+
+PAYLOAD_PATH = '/Vmi6869kJM7vS70sZKXrwn5Lq0CORjRl'
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class TrekkySite:
+    """The state of the website: catalog, sessions and counters. Shared by all handler threads."""
+
+    def __init__(self, cities, hotels_per_page=6, reviews=(0, 50), rate=2.0, burst=5, latency=0.0, seed=0):
+        self.cities = cities
+        self.hotels_per_page = hotels_per_page
+        self.reviews = reviews
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.seed = seed
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.buckets = {}
+        self.counters = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.sessions.clear()
+            self.buckets.clear()
+            self.counters.clear()
+
+    def new_session(self, level):
+        session_id = secrets.token_hex(8)
+        with self.lock:
+            self.sessions[session_id] = {'level': level, 'approved': False}
+        return session_id
+
+    def allow(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket.take()
+
+    def hotel_ids(self, city, page):
+        pages = self.cities.get(city, 0)
+        if page < 1 or page > pages:
+            return []
+        first = (sorted(self.cities).index(city) * 10000) + (page - 1) * self.hotels_per_page
+        return list(range(first, first + self.hotels_per_page))
+
+    def hotel(self, hotel_id):
+        rnd = random.Random(self.seed * 1000003 + hotel_id)
+        ratings = [rnd.choice((1, 2, 3, 4, 5)) + rnd.choice((0, 0.5)) for _ in range(rnd.randint(*self.reviews))]
+        return {
+            'name': f'Hotel {hotel_id}',
+            'email': f'contact@hotel-{hotel_id}.example',
+            'ratings': [min(r, 5) for r in ratings],
+        }
+
+
+def render_page(title, body):
+    return (
+        f'<!DOCTYPE html><html><head><title>{title}</title></head>'
+        f'<body><main>{body}</main></body></html>'
+    )
+
+
+class TrekkyHandler(BaseHTTPRequestHandler):
+    site: TrekkySite = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # Several requests are handled per connection when the client keeps it alive.
+        self.site.count('connections')
+        super().handle()
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        site = self.site
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if url.path == '/__stats':
+            with site.lock:
+                return self._send(200, json.dumps(site.counters), 'application/json')
+        if url.path == '/__reset':
+            site.reset()
+            return self._send(200, '{}', 'application/json')
+
+        if site.latency:
+            time.sleep(site.latency)
+
+        site.count('requests')
+
+        # The level comes from the path (/level3/...) or from the session for relative pages (/cities, /hotels).
+        match = re.match(r'^/level(\d+)(/.*)?$', url.path)
+        path = (match.group(2) or '/') if match else url.path
+
+        cookies = SimpleCookie(self.headers.get('Cookie', ''))
+        session_id = cookies['session'].value if 'session' in cookies else None
+        session = site.sessions.get(session_id)
+
+        if match and path == '/':
+            level = int(match.group(1))
+            session_id = site.new_session(level)
+            site.count('homepages')
+            return self._send(
+                200,
+                render_page('Trekky', f'<a class="city-link" href="cities?city=paris&amp;page=1">Paris</a>'),
+                cookies={'session': session_id},
+            )
+
+        level = int(match.group(1)) if match else (session['level'] if session else 1)
+
+        if level >= 2 and session is None:
+            return self._error(403, 'Session required', 'Visit the homepage first.')
+
+        if level >= 3 and not site.allow(session_id or self.client_address[0]):
+            site.count('rate_limited')
+            return self._send(429, render_page('Too many requests', '<h1>Too many requests</h1>'))
+
+        if path == PAYLOAD_PATH and self.command == 'POST':
+            payload = parse_qs(body.decode('utf-8', 'replace')).get('payload', [''])[0]
+            try:
+                valid = len(b64decode(payload, validate=True)) == 256
+            except (binascii.Error, ValueError):
+                valid = False
+            if not valid:
+                return self._error(400, 'Invalid payload')
+            session['approved'] = True
+            site.count('payloads')
+            return self._send(200, render_page('Approved', '<p>OK</p>'))
+
+        if level >= 8 and not session['approved']:
+            return self._error(403, 'Unknown browser', 'The antibot payload is missing.')
+
+        if path == '/cities':
+            return self._listing(query.get('city', ['paris'])[0], int(query.get('page', ['1'])[0]))
+
+        hotel_match = re.match(r'^/hotels/(\d+)$', path)
+        if hotel_match:
+            return self._hotel(int(hotel_match.group(1)))
+
+        return self._error(404, 'Not found')
+
+    def _listing(self, city, page):
+        site = self.site
+        site.count('listings')
+
+        links = ''.join(
+            f'<div class="hotel-card"><a class="hotel-link" href="/hotels/{hotel_id}">Hotel {hotel_id}</a>'
+            f'<span class="hotel-reviews-count">{len(site.hotel(hotel_id)["ratings"])} reviews</span></div>'
+            for hotel_id in site.hotel_ids(city, page)
+        )
+        pagination = ''.join(
+            f'<a class="page-link" href="cities?city={city}&amp;page={p}">{p}</a>'
+            for p in range(1, site.cities.get(city, 0) + 1)
+        )
+        return self._send(200, render_page(f'Hotels in {city}', f'{links}<nav class="pagination">{pagination}</nav>'))
+
+    def _hotel(self, hotel_id):
+        site = self.site
+        site.count('hotels')
+
+        hotel = site.hotel(hotel_id)
+        reviews = ''.join(
+            f'<div class="hotel-review"><span class="review-rating">{rating}</span>'
+            f'<p class="review-text">Review {i}</p></div>'
+            for i, rating in enumerate(hotel['ratings'])
+        )
+        body = render_page(
+            hotel['name'],
+            f'<h1 class="hotel-name">{hotel["name"]}</h1>'
+            f'<span class="hotel-email">{hotel["email"]}</span>{reviews}',
+        )
+
+        # Hotel pages never change here: they can be revalidated with If-None-Match.
+        etag = '"%08x"' % zlib.crc32(body.encode('utf-8'))
+        if etag in self.headers.get('If-None-Match', ''):
+            site.count('not_modified')
+            return self._send(304, '', headers={'ETag': etag})
+        return self._send(200, body, headers={'ETag': etag, 'Last-Modified': LAST_MODIFIED})
+
+    def _error(self, status, message, description=None):
+        error = {'message': message}
+        if description:
+            error['description'] = description
+        return self._send(status, json.dumps(error), 'application/json')
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', cookies=None, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        for name, value in (cookies or {}).items():
+            self.send_header('Set-Cookie', f'{name}={value}; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_cities(value):
+    cities = {}
+    for part in value.split(','):
+        name, _, pages = part.partition(':')
+        cities[name.strip()] = int(pages or 9)
+    return cities
+
+
+def create_server(host='127.0.0.1', port=8888, **kwargs):
+    """Create the server. Call serve_forever() on the result, in a thread if needed."""
+    handler = type('Handler', (TrekkyHandler,), {'site': TrekkySite(**kwargs)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--cities', type=parse_cities, default={'paris': 9}, help='city:pages,... (default: paris:9)')
+    parser.add_argument('--hotels-per-page', type=int, default=6)
+    parser.add_argument('--min-reviews', type=int, default=0)
+    parser.add_argument('--max-reviews', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=2.0, help='requests per second per session, from level 3')
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    args = parser.parse_args()
+
+    server = create_server(
+        args.host, args.port,
+        cities=args.cities,
+        hotels_per_page=args.hotels_per_page,
+        reviews=(args.min_reviews, args.max_reviews),
+        rate=args.rate,
+        burst=args.burst,
+        latency=args.latency,
+    )
+    print(f'Trekky stand-in listening on http://{args.host}:{args.port}/level1')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()